@@ -0,0 +1,118 @@
+"""
+Scores a CSV or Parquet file of borrowers in fixed-size chunks with the saved preprocessor and
+stacking model, and appends the probabilities of default to a Parquet file chunk by chunk, so
+memory stays flat no matter the input size.
+
+    python batch_scoring.py GiveMeSomeCredit/cs-test.csv predictions.parquet --chunk-size 100000 --workers 4
+"""
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_preprocessing_pipeline import TARGET_COLUMN
+from tree_compiler import CompiledStackingModel
+
+# set per process by load_artifacts()
+_model = None
+_preprocessor = None
+
+
+def load_artifacts(model_path, preprocessor_path):
+    global _model, _preprocessor
+    if model_path.endswith('.npz') or os.path.isdir(model_path):
+        _model = CompiledStackingModel.load(model_path)
+    else:
+        _model = joblib.load(model_path)
+    _preprocessor = joblib.load(preprocessor_path) if preprocessor_path else None
+
+
+def iter_chunks(input_path, chunk_size):
+    if input_path.endswith('.parquet'):
+        for batch in pq.ParquetFile(input_path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(input_path, chunksize=chunk_size)
+
+
+def score_chunk(chunk, id_column):
+    """
+    Returns a frame with the id column (when present) and the probability of default of each row.
+    """
+    ids = chunk[id_column] if id_column in chunk.columns else None
+    features = chunk.drop(columns=[column for column in (id_column, TARGET_COLUMN) if column in chunk.columns])
+    if _preprocessor is not None:
+        features = _preprocessor.transform(features)
+
+    probabilities = _model.predict_proba(features[list(_model.feature_names_in_)])[:, 1]
+
+    scored = pd.DataFrame({'probability_of_default': probabilities.astype(np.float64)})
+    if ids is not None:
+        scored.insert(0, id_column, ids.to_numpy())
+    return scored
+
+
+def score_file(input_path, output_path, model_path, preprocessor_path=None, chunk_size=100_000, workers=1, id_column='Unnamed: 0'):
+    """
+    Streams input_path through the model and writes output_path incrementally. With workers > 1
+    chunks are scored in a process pool; at most 2 chunks per worker are in flight and results are
+    written in input order.
+    """
+    start = time.perf_counter()
+    writer = None
+    n_rows = 0
+
+    def write(scored):
+        nonlocal writer, n_rows
+        table = pa.Table.from_pandas(scored, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(output_path, table.schema)
+        writer.write_table(table)
+        n_rows += len(scored)
+
+    try:
+        if workers <= 1:
+            load_artifacts(model_path, preprocessor_path)
+            for chunk in iter_chunks(input_path, chunk_size):
+                write(score_chunk(chunk, id_column))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=load_artifacts, initargs=(model_path, preprocessor_path)) as executor:
+                in_flight = deque()
+                for chunk in iter_chunks(input_path, chunk_size):
+                    in_flight.append(executor.submit(score_chunk, chunk, id_column))
+                    if len(in_flight) >= 2 * workers:
+                        write(in_flight.popleft().result())
+                while in_flight:
+                    write(in_flight.popleft().result())
+    finally:
+        if writer is not None:
+            writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {n_rows} rows in {elapsed:.1f}s ({n_rows / max(elapsed, 1e-9):,.0f} rows/s) -> {output_path}")
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="CSV or .parquet file with the raw GiveMeSomeCredit columns")
+    parser.add_argument('output', help="Parquet file for the probabilities")
+    parser.add_argument('--model', default='stacking_model.pkl', help="joblib stacking model or compiled model (.npz file or directory)")
+    parser.add_argument('--preprocessor', default='preprocessor.joblib', help="fitted CreditDataPreprocessor, '' to skip")
+    parser.add_argument('--chunk-size', type=int, default=100_000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--id-column', default='Unnamed: 0', help="column copied to the output to identify rows")
+    args = parser.parse_args()
+
+    score_file(args.input, args.output, args.model, args.preprocessor or None, args.chunk_size, args.workers, args.id_column)
+
+
+if __name__ == '__main__':
+    main()
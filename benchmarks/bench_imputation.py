@@ -0,0 +1,81 @@
+"""
+Time / accuracy trade-off of the imputation strategies of CreditDataPreprocessor.
+
+A share of the observed MonthlyIncome and NumberOfDependents values is hidden, every strategy
+imputes the matrix, and the imputed values are compared with the hidden ones.
+
+    python -m benchmarks.bench_imputation --rows 150000 --output bench_imputation.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from benchmarks.bench_preprocessing import fit_caps
+from benchmarks.synthetic_data import make_credit_data
+from data_preprocessing_pipeline import IMPUTATION_STRATEGIES, build_imputer
+
+MASKED_COLUMNS = ['MonthlyIncome', 'NumberOfDependents']
+
+
+def masked_feature_matrix(n_rows, mask_fraction, random_state):
+    dataframe = make_credit_data(n_rows, random_state=random_state).drop(columns='SeriousDlqin2yrs')
+    preprocessor = fit_caps(dataframe)
+
+    values = preprocessor._feature_values(dataframe)
+    preprocessor._replace_outliers(values)
+    column = preprocessor._column_positions()
+    rng = np.random.default_rng(random_state)
+
+    hidden = {}
+    for name in MASKED_COLUMNS:
+        observed_rows = np.flatnonzero(~np.isnan(values[:, column[name]]))
+        rows = rng.choice(observed_rows, int(len(observed_rows) * mask_fraction), replace=False)
+        hidden[name] = (rows, values[rows, column[name]].copy())
+        values[rows, column[name]] = np.nan
+    return values, column, hidden
+
+
+def evaluate(strategy, values, column, hidden, max_iter, tol):
+    imputer = build_imputer(strategy, max_iter=max_iter, tol=tol)
+
+    start = time.perf_counter()
+    imputed = imputer.fit_transform(values.copy())
+    seconds = time.perf_counter() - start
+
+    result = {'strategy': strategy, 'fit_transform_seconds': round(seconds, 3)}
+    if hasattr(imputer, 'n_iter_'):
+        result['iterations'] = int(imputer.n_iter_)
+    for name, (rows, truth) in hidden.items():
+        error = imputed[rows, column[name]] - truth
+        result[f'{name}_mae'] = round(float(np.mean(np.abs(error))), 4)
+        result[f'{name}_rmse'] = round(float(np.sqrt(np.mean(error ** 2))), 4)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=150_000)
+    parser.add_argument('--mask-fraction', type=float, default=0.1, help="share of observed values hidden per column")
+    parser.add_argument('--strategies', nargs='+', default=IMPUTATION_STRATEGIES, choices=IMPUTATION_STRATEGIES)
+    parser.add_argument('--max-iter', type=int, default=10)
+    parser.add_argument('--tol', type=float, default=1e-3)
+    parser.add_argument('--output', default=None, help="optional JSON file for the results")
+    args = parser.parse_args()
+
+    values, column, hidden = masked_feature_matrix(args.rows, args.mask_fraction, random_state=0)
+
+    results = []
+    for strategy in args.strategies:
+        result = evaluate(strategy, values, column, hidden, args.max_iter, args.tol)
+        results.append(result)
+        print(result)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Compares the per-column pandas outlier passes of the original wrangle() with the fused, in-place
+NumPy passes of CreditDataPreprocessor (imputation excluded, it is the same in both).
+
+Every (implementation, size) pair runs in its own process so that peak RSS is not shared.
+
+    python -m benchmarks.bench_preprocessing --rows 150000 1500000 15000000 --output bench_preprocessing.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.resources import measure
+from benchmarks.synthetic_data import make_credit_data
+from data_preprocessing_pipeline import CreditDataPreprocessor, RENAMED_COLUMNS, PAST_DUE_COLUMNS
+
+
+def fit_caps(dataframe):
+    """
+    Fits the caps and medians of a CreditDataPreprocessor without the (slow, unchanged) imputer.
+    """
+    preprocessor = CreditDataPreprocessor()
+    preprocessor.feature_names_in_ = np.array([RENAMED_COLUMNS.get(column, column) for column in dataframe.columns if column != preprocessor.target_column], dtype=object)
+    renamed = dataframe.rename(columns=RENAMED_COLUMNS)
+    preprocessor.revolving_utilization_upper_cap_ = renamed['RevolvingUtilizationOfUnsecuredLines'].quantile(0.99)
+    preprocessor.age_median_ = renamed['age'].median()
+    preprocessor.past_due_medians_ = {column: renamed[column].median() for column in PAST_DUE_COLUMNS}
+    preprocessor.monthly_income_upper_cap_ = renamed['MonthlyIncome'].clip(lower=0).quantile(0.99)
+    preprocessor.debt_ratio_upper_cap_ = renamed['DebtRatio'].quantile(0.99)
+    return preprocessor
+
+
+def legacy_passes(preprocessor, dataframe):
+    """
+    The outlier handling of the original wrangle(), one frame, imputer removed.
+    """
+    dataframe['RevolvingUtilizationOfUnsecuredLines'] = dataframe['RevolvingUtilizationOfUnsecuredLines'].clip(upper=preprocessor.revolving_utilization_upper_cap_)
+    mean_age = preprocessor.age_median_
+    dataframe['age'] = dataframe['age'].apply(lambda x: mean_age if x < 18 else x)
+    dataframe["NumberOfTime30-59DaysPastDueNotWorse"] = dataframe['NumberOfTime30-59DaysPastDueNotWorse'].replace([98, 96], preprocessor.past_due_medians_['NumberOfTime30_59DaysPastDueNotWorse'])
+    dataframe["NumberOfTimes90DaysLate"] = dataframe['NumberOfTimes90DaysLate'].replace([98, 96], preprocessor.past_due_medians_['NumberOfTimes90DaysLate'])
+    dataframe["NumberOfTime60-89DaysPastDueNotWorse"] = dataframe['NumberOfTime60-89DaysPastDueNotWorse'].replace([98, 96], preprocessor.past_due_medians_['NumberOfTime60_89DaysPastDueNotWorse'])
+
+    dataframe = pd.DataFrame(dataframe.to_numpy(dtype=np.float64), columns=dataframe.columns)
+
+    dataframe['MonthlyIncome'] = dataframe['MonthlyIncome'].clip(lower=0)
+    dataframe['MonthlyIncome'] = dataframe['MonthlyIncome'].clip(upper=preprocessor.monthly_income_upper_cap_)
+    dataframe['DebtRatio'] = dataframe['DebtRatio'].clip(upper=preprocessor.debt_ratio_upper_cap_)
+    dataframe['NumberRealEstateLoansOrLines'] = dataframe['NumberRealEstateLoansOrLines'].clip(upper=17)
+    dataframe.rename(columns=RENAMED_COLUMNS, inplace=True)
+    return dataframe
+
+
+def fused_passes(preprocessor, dataframe):
+    values = preprocessor._feature_values(dataframe)
+    preprocessor._replace_outliers(values)
+    preprocessor._cap_after_imputation(values)
+    return preprocessor._to_dataframe(dataframe, values)
+
+
+IMPLEMENTATIONS = {'legacy': legacy_passes, 'fused': fused_passes}
+
+
+def run_worker(implementation, n_rows):
+    dataframe = make_credit_data(n_rows)
+    preprocessor = fit_caps(dataframe)
+
+    _, elapsed, peak_increase_mb = measure(IMPLEMENTATIONS[implementation], preprocessor, dataframe)
+
+    return {
+        'implementation': implementation,
+        'rows': n_rows,
+        'seconds': round(elapsed, 4),
+        'peak_rss_increase_mb': round(peak_increase_mb, 1),
+        'input_mb': round(dataframe.memory_usage(deep=True).sum() / 2**20, 1),
+    }
+
+
+def check_identical(n_rows=100_000):
+    dataframe = make_credit_data(n_rows)
+    preprocessor = fit_caps(dataframe)
+    legacy = legacy_passes(preprocessor, dataframe.copy())
+    fused = fused_passes(preprocessor, dataframe.copy())
+    pd.testing.assert_frame_equal(legacy, fused)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[150_000, 1_500_000, 15_000_000])
+    parser.add_argument('--implementations', nargs='+', default=list(IMPLEMENTATIONS), choices=list(IMPLEMENTATIONS))
+    parser.add_argument('--output', default=None, help="optional JSON file for the results")
+    parser.add_argument('--worker', nargs=2, metavar=('IMPLEMENTATION', 'ROWS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker[0], int(args.worker[1]))))
+        return
+
+    check_identical()
+    print("legacy and fused outputs are identical")
+
+    results = []
+    for n_rows in args.rows:
+        for implementation in args.implementations:
+            completed = subprocess.run([sys.executable, '-m', 'benchmarks.bench_preprocessing', '--worker', implementation, str(n_rows)], capture_output=True, text=True)
+            if completed.returncode != 0:
+                result = {'implementation': implementation, 'rows': n_rows, 'error': completed.stderr.strip().splitlines()[-1:] or f"exit code {completed.returncode}"}
+            else:
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(result)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
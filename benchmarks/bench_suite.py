@@ -0,0 +1,502 @@
+"""
+End-to-end benchmark of the pipeline on synthetic GiveMeSomeCredit-shaped data:
+
+- preprocessing: CreditDataPreprocessor fit_transform / transform (what wrangle() runs)
+- training: model_training_pipeline.training
+- evaluation: classification_evaluation, headless
+- serving: POST /predict and /predict/batch at fixed concurrency levels, either in-process through
+  the ASGI app or against a local uvicorn server, then every GET route once after that traffic
+
+Every stage runs in its own process, so peak RSS is per stage, in a scratch directory holding the
+artifacts the next stage needs. Results are written as JSON; with --baseline a previous result file
+is compared metric by metric and changes beyond --tolerance are reported as regressions.
+
+    python -m benchmarks.bench_suite --rows 50000 --output bench_suite.json
+    python -m benchmarks.bench_suite --rows 50000 --baseline bench_suite.json --output bench_new.json --fail-on-regression
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from benchmarks.resources import measure, memory_kb
+from benchmarks.synthetic_data import make_credit_data
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ['preprocessing', 'training', 'evaluation', 'serving']
+TARGET = 'SeriousDlqin2yrs'
+
+# metric name suffix -> True when higher is better
+METRIC_DIRECTIONS = {'seconds': False, 'peak_rss_increase_mb': False, 'rss_mb': False, 'requests_per_second': True,
+                     'p50_ms': False, 'p95_ms': False, 'p99_ms': False}
+
+
+def benchmark_estimators():
+    """
+    Fixed stand-ins for best_rfc.pkl / best_xgbc.pkl / best_lgbmc.pkl, so runs are comparable
+    without the tuned models. Pass --estimators to benchmark the tuned ones instead.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from xgboost import XGBClassifier
+    from lightgbm import LGBMClassifier
+
+    return {
+        'best_rfc.pkl': RandomForestClassifier(n_estimators=100, max_depth=12, n_jobs=-1, random_state=42),
+        'best_xgbc.pkl': XGBClassifier(n_estimators=200, max_depth=5, learning_rate=0.05, n_jobs=-1, random_state=42),
+        'best_lgbmc.pkl': LGBMClassifier(n_estimators=200, learning_rate=0.05, num_leaves=31, random_state=42, verbose=-1),
+    }
+
+
+def _quiet(function, *args, **kwargs):
+    # the pipeline functions print their progress; keep stdout for the JSON result line
+    with contextlib.redirect_stdout(io.StringIO()):
+        return measure(function, *args, **kwargs)
+
+
+def _split(workdir):
+    from sklearn.model_selection import train_test_split
+
+    train = pd.read_parquet(os.path.join(workdir, 'train_processed.parquet'))
+    X, y = train.drop(columns=TARGET), train[TARGET]
+    return train_test_split(X, y, test_size=0.1, stratify=y, random_state=42)
+
+
+def run_preprocessing(workdir, config):
+    from data_preprocessing_pipeline import CreditDataPreprocessor
+
+    train = make_credit_data(config['rows'], random_state=config['seed'])
+    test = make_credit_data(max(1, config['rows'] // 2), random_state=config['seed'] + 1, with_target=False)
+    test.to_parquet(os.path.join(workdir, 'test_raw.parquet'))
+
+    preprocessor = CreditDataPreprocessor(imputation_strategy=config['imputation_strategy'])
+    processed_train, fit_seconds, fit_peak = _quiet(preprocessor.fit_transform, train)
+    _, transform_seconds, transform_peak = _quiet(preprocessor.transform, test)
+
+    processed_train.to_parquet(os.path.join(workdir, 'train_processed.parquet'))
+    joblib.dump(preprocessor, os.path.join(workdir, 'preprocessor.joblib'))
+    joblib.dump(preprocessor.without_imputer(), os.path.join(workdir, 'preprocessor_serving.joblib'))
+
+    return {
+        'fit_transform': {'rows': len(train), 'seconds': round(fit_seconds, 4), 'peak_rss_increase_mb': round(fit_peak, 1)},
+        'transform': {'rows': len(test), 'seconds': round(transform_seconds, 4), 'peak_rss_increase_mb': round(transform_peak, 1)},
+    }
+
+
+def run_training(workdir, config):
+    from model_training_pipeline import training
+
+    if config['estimators']:
+        for name in benchmark_estimators():
+            shutil.copy(os.path.join(config['estimators'], name), workdir)
+    else:
+        for name, estimator in benchmark_estimators().items():
+            joblib.dump(estimator, os.path.join(workdir, name))
+
+    X_train, _, y_train, _ = _split(workdir)
+    # training() reads the tuned estimators from and writes the models to the working directory
+    os.chdir(workdir)
+    _, seconds, peak = _quiet(training, X_train, y_train, mode=config['training_mode'], cache_dir=os.path.join(workdir, '.stacking_cache'))
+    # the API loads stacking_model.joblib
+    shutil.copy('stacking_model.pkl', 'stacking_model.joblib')
+
+    return {'fit': {'rows': len(X_train), 'mode': config['training_mode'], 'seconds': round(seconds, 4), 'peak_rss_increase_mb': round(peak, 1)}}
+
+
+def run_evaluation(workdir, config):
+    from model_evaluation_pipeline import classification_evaluation
+
+    X_train, X_val, y_train, y_val = _split(workdir)
+    model = joblib.load(os.path.join(workdir, 'stacking_model.pkl'))
+    results, seconds, peak = _quiet(classification_evaluation, model, X_train, y_train, X_val, y_val, output_dir=os.path.join(workdir, 'evaluation'))
+
+    return {'classification_evaluation': {'rows': len(X_train) + len(X_val), 'seconds': round(seconds, 4), 'peak_rss_increase_mb': round(peak, 1),
+                                          'test_auc_roc': round(results['test']['auc_roc'], 4)}}
+
+
+def request_payloads(workdir, n_payloads):
+    """
+    Valid UserInput payloads derived from the raw synthetic test rows: the two ratios are turned
+    back into balances and debt payments, rows outside the UserInput limits are skipped.
+    """
+    test = pd.read_parquet(os.path.join(workdir, 'test_raw.parquet')).dropna(subset=['MonthlyIncome', 'NumberOfDependents'])
+    test = test[(test['age'] >= 10) & (test['age'] <= 110)
+                & (test['NumberOfTime30-59DaysPastDueNotWorse'] <= 15) & (test['NumberOfTimes90DaysLate'] <= 20)
+                & (test['NumberOfTime60-89DaysPastDueNotWorse'] <= 12) & (test['NumberOfOpenCreditLinesAndLoans'] <= 60)
+                & (test['NumberRealEstateLoansOrLines'] <= 60) & (test['NumberOfDependents'] <= 10)].head(n_payloads)
+
+    credit_limit = 10_000.0
+    return [{
+        'age': int(row['age']),
+        'total_unsecured_balance': float(row['RevolvingUtilizationOfUnsecuredLines']) * credit_limit,
+        'total_unsecured_credit_limit': credit_limit,
+        'total_monthly_debt_payment': float(row['DebtRatio'] * row['MonthlyIncome']),
+        'MonthlyIncome': float(row['MonthlyIncome']),
+        'NumberOfOpenCreditLinesAndLoans': int(row['NumberOfOpenCreditLinesAndLoans']),
+        'NumberOfTime30_59DaysPastDueNotWorse': int(row['NumberOfTime30-59DaysPastDueNotWorse']),
+        'NumberOfTimes90DaysLate': int(row['NumberOfTimes90DaysLate']),
+        'NumberRealEstateLoansOrLines': int(row['NumberRealEstateLoansOrLines']),
+        'NumberOfTime60_89DaysPastDueNotWorse': int(row['NumberOfTime60-89DaysPastDueNotWorse']),
+        'NumberOfDependents': int(row['NumberOfDependents']),
+    } for _, row in test.iterrows()]
+
+
+def request_bodies(payloads, endpoint, batch_size):
+    if endpoint == '/predict':
+        return [json.dumps(payload).encode() for payload in payloads]
+    return [json.dumps({'records': payloads[start:start + batch_size]}).encode() for start in range(0, len(payloads), batch_size)]
+
+
+async def asgi_request(app, path, body=b'', method='POST'):
+    """
+    One request straight through the ASGI app, without sockets or an HTTP client. Returns the status.
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 80),
+    }
+    response_sent = asyncio.Event()
+    request_sent = False
+    status = None
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await response_sent.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body' and not message.get('more_body', False):
+            response_sent.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+async def _asgi_load(app, path, bodies, concurrency, n_requests):
+    latencies, statuses = [], []
+    next_request = 0
+
+    async def client():
+        nonlocal next_request
+        while next_request < n_requests:
+            body = bodies[next_request % len(bodies)]
+            next_request += 1
+            start = time.perf_counter()
+            statuses.append(await asgi_request(app, path, body))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def _http_load(url, bodies, concurrency, n_requests):
+    import requests
+
+    local = threading.local()
+    counter = iter(range(n_requests))
+    counter_lock = threading.Lock()
+    latencies, statuses = [], []
+
+    def client():
+        local.session = requests.Session()
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            response = local.session.post(url, data=bodies[index % len(bodies)], headers={'content-type': 'application/json'})
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(client) for _ in range(concurrency)]:
+            future.result()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def check_get_routes(paths, get):
+    """
+    Calls every GET route without path parameters of the OpenAPI `paths` once with `get(path)`,
+    which returns the status. A 5xx other than 503 (a feature that is switched off) is an error.
+    """
+    routes = sorted(path for path, methods in paths.items() if 'get' in methods and '{' not in path)
+    statuses = {path: get(path) for path in routes}
+    failed = [path for path, status in statuses.items() if status >= 500 and status != 503]
+    return {'routes': len(routes), 'errors': len(failed), 'failed': failed}
+
+
+def _load_summary(latencies, statuses, seconds, rows_per_request):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': int(sum(status != 200 for status in statuses)),
+        'seconds': round(seconds, 4),
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'rows_per_second': round(len(latencies) * rows_per_request / seconds, 1),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 3),
+        'max_ms': round(float(latencies_ms.max()), 3),
+    }
+
+
+@contextlib.contextmanager
+def local_uvicorn(workdir, engine, port):
+    """
+    Runs `uvicorn fastapi_backend:app` in workdir and waits for /ready. Yields the server pid.
+    """
+    import requests
+
+    env = dict(os.environ, MODEL_ENGINE=engine, PREDICTION_CACHE_SIZE='0', PYTHONPATH=REPOSITORY_ROOT)
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'fastapi_backend:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+                              cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 120
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {server.returncode}")
+            try:
+                if requests.get(f'http://127.0.0.1:{port}/ready', timeout=1).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError("uvicorn did not become ready within 120s")
+            time.sleep(0.2)
+        yield server.pid
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _process_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS'):
+                return round(int(line.split()[1]) / 1024, 1)
+
+
+def run_serving(workdir, config):
+    payloads = request_payloads(workdir, 2_000)
+    endpoints = {'/predict': 1, '/predict/batch': config['batch_size']}
+    results = {}
+
+    for engine in config['engines']:
+        if config['server'] == 'uvicorn':
+            server = local_uvicorn(workdir, engine, config['port'])
+        else:
+            server = contextlib.nullcontext(None)
+
+        with server as pid:
+            if pid is None:
+                # in-process: the app reads its artifacts from the working directory at import
+                os.chdir(workdir)
+                os.environ.update(MODEL_ENGINE=engine, PREDICTION_CACHE_SIZE='0')
+                with contextlib.redirect_stdout(io.StringIO()):
+                    import fastapi_backend
+                rss_mb = round(memory_kb('VmRSS') / 1024, 1)
+            else:
+                rss_mb = _process_rss_mb(pid)
+            results[f'{engine}/server'] = {'rss_mb': rss_mb}
+
+            for endpoint, rows_per_request in endpoints.items():
+                bodies = request_bodies(payloads, endpoint, rows_per_request)
+                for concurrency in config['concurrency']:
+                    n_requests = config['requests'] if endpoint == '/predict' else max(concurrency, config['requests'] // rows_per_request)
+                    if pid is None:
+                        load = lambda n: asyncio.run(_asgi_load(fastapi_backend.app, endpoint, bodies, concurrency, n))
+                    else:
+                        load = lambda n: _http_load(f"http://127.0.0.1:{config['port']}{endpoint}", bodies, concurrency, n)
+                    load(min(n_requests, 10 * concurrency))  # warm-up
+                    summary = _load_summary(*load(n_requests), rows_per_request)
+                    results[f'{engine}{endpoint}/concurrency={concurrency}'] = summary
+
+            # the stats and metrics routes only have something to serialize after traffic
+            if pid is None:
+                paths = fastapi_backend.app.openapi()['paths']
+                get = lambda path: asyncio.run(asgi_request(fastapi_backend.app, path, method='GET'))
+            else:
+                import requests
+                base_url = f"http://127.0.0.1:{config['port']}"
+                paths = requests.get(f'{base_url}/openapi.json').json()['paths']
+                get = lambda path: requests.get(base_url + path).status_code
+            results[f'{engine}/get_routes'] = check_get_routes(paths, get)
+
+        if pid is None and len(config['engines']) > 1:
+            # the in-process app is bound to the engine it was imported with
+            del sys.modules['fastapi_backend']
+
+    return results
+
+
+STAGE_RUNNERS = {'preprocessing': run_preprocessing, 'training': run_training, 'evaluation': run_evaluation, 'serving': run_serving}
+
+
+def run_stage(stage, workdir):
+    completed = subprocess.run([sys.executable, '-m', 'benchmarks.bench_suite', '--worker', stage, workdir],
+                               capture_output=True, text=True, cwd=REPOSITORY_ROOT)
+    if completed.returncode != 0:
+        return {'error': (completed.stderr.strip().splitlines() or [f"exit code {completed.returncode}"])[-1]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def environment():
+    def version(module):
+        try:
+            return __import__(module).__version__
+        except ImportError:
+            return None
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=REPOSITORY_ROOT).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': {module: version(module) for module in ('numpy', 'pandas', 'sklearn', 'xgboost', 'lightgbm', 'fastapi', 'pydantic')},
+    }
+
+
+def flatten_metrics(results):
+    """
+    {'preprocessing/rows=50000/fit_transform/seconds': 1.2, ...} for every metric with a known direction.
+    """
+    metrics = {}
+    for scale in results['scales']:
+        for stage, measurements in scale['stages'].items():
+            for name, values in measurements.items():
+                for metric, value in values.items():
+                    if metric in METRIC_DIRECTIONS and isinstance(value, (int, float)):
+                        metrics[f"{stage}/rows={scale['rows']}/{name}/{metric}"] = value
+    return metrics
+
+
+def compare(results, baseline, tolerance, min_delta_ms=1.0):
+    """
+    Relative change of every metric present in both runs; a change for the worse beyond `tolerance`
+    is a regression. Time differences below `min_delta_ms` are treated as noise.
+    """
+    current, previous = flatten_metrics(results), flatten_metrics(baseline)
+    comparisons = []
+    for key in sorted(current.keys() & previous.keys()):
+        if previous[key] == 0:
+            continue
+        change = (current[key] - previous[key]) / abs(previous[key])
+        higher_is_better = METRIC_DIRECTIONS[key.rsplit('/', 1)[-1]]
+        worse = -change if higher_is_better else change
+        metric = key.rsplit('/', 1)[-1]
+        delta_ms = abs(current[key] - previous[key]) * (1000 if metric == 'seconds' else 1)
+        if (metric == 'seconds' or metric.endswith('_ms')) and delta_ms < min_delta_ms:
+            worse = 0.0
+        comparisons.append({'metric': key, 'baseline': previous[key], 'current': current[key], 'change': round(change, 4),
+                            'regression': worse > tolerance, 'improvement': worse < -tolerance})
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[20_000, 100_000], help="training rows per scale")
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help="later stages need the artifacts of the earlier ones")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--imputation-strategy', default='iterative_rf')
+    parser.add_argument('--training-mode', default='sequential', choices=['sequential', 'parallel'])
+    parser.add_argument('--estimators', default=None, help="directory with best_rfc.pkl, best_xgbc.pkl and best_lgbmc.pkl (default: fixed benchmark estimators)")
+    parser.add_argument('--server', default='asgi', choices=['asgi', 'uvicorn'], help="drive the app in-process or through a local uvicorn")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--engines', nargs='+', default=['joblib', 'compiled'], choices=['joblib', 'compiled'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=2_000, help="requests per /predict load level (rows for /predict/batch)")
+    parser.add_argument('--batch-size', type=int, default=100, help="records per /predict/batch request")
+    parser.add_argument('--output', default=None, help="optional JSON file for the results")
+    parser.add_argument('--baseline', default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help="time differences below this are never regressions")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit with status 1 when a regression is found")
+    parser.add_argument('--keep-workdir', action='store_true')
+    parser.add_argument('--worker', nargs=2, metavar=('STAGE', 'WORKDIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        stage, workdir = args.worker
+        with open(os.path.join(workdir, 'config.json')) as config_file:
+            config = json.load(config_file)
+        print(json.dumps(STAGE_RUNNERS[stage](workdir, config)))
+        return
+
+    config = {
+        'seed': args.seed, 'imputation_strategy': args.imputation_strategy, 'training_mode': args.training_mode,
+        'estimators': os.path.abspath(args.estimators) if args.estimators else None, 'server': args.server, 'port': args.port,
+        'engines': args.engines, 'concurrency': args.concurrency, 'requests': args.requests, 'batch_size': args.batch_size,
+    }
+    results = {'environment': environment(), 'config': {**config, 'stages': args.stages}, 'scales': []}
+
+    for n_rows in args.rows:
+        workdir = tempfile.mkdtemp(prefix=f'bench_suite_{n_rows}_')
+        with open(os.path.join(workdir, 'config.json'), 'w') as config_file:
+            json.dump({**config, 'rows': n_rows}, config_file)
+
+        scale = {'rows': n_rows, 'stages': {}}
+        for stage in args.stages:
+            scale['stages'][stage] = run_stage(stage, workdir)
+            print(f"rows={n_rows} {stage}: {json.dumps(scale['stages'][stage])}")
+        results['scales'].append(scale)
+
+        if args.keep_workdir:
+            print(f"Artifacts kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            results['comparison'] = compare(results, json.load(baseline_file), args.tolerance, args.min_delta_ms)
+        regressions = [comparison for comparison in results['comparison'] if comparison['regression']]
+        for comparison in results['comparison']:
+            flag = 'REGRESSION' if comparison['regression'] else 'improved' if comparison['improvement'] else ''
+            print(f"{comparison['metric']}: {comparison['baseline']} -> {comparison['current']} ({comparison['change']:+.1%}) {flag}")
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    failed_routes = [f"rows={scale['rows']} {name}: {values['failed']}" for scale in results['scales']
+                     for name, values in scale['stages'].get('serving', {}).items() if name.endswith('/get_routes') and values['failed']]
+    for failure in failed_routes:
+        print(f"GET routes failing after traffic, {failure}")
+
+    if failed_routes or (regressions and args.fail_on_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
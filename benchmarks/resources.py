@@ -0,0 +1,34 @@
+import time
+
+
+def memory_kb(field):
+    """
+    A field of /proc/self/status in kB, e.g. VmRSS (resident set) or VmHWM (its high-water mark).
+    """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1])
+
+
+def reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets the VmHWM high-water mark
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def measure(function, *args, **kwargs):
+    """
+    Calls function(*args, **kwargs) and returns its result, the wall time in seconds and the peak
+    RSS increase in MB over the call. Run one measurement per process, the peak is process-wide.
+    """
+    reset_peak_rss()
+    rss_before = memory_kb('VmRSS')
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak = memory_kb('VmHWM')
+    return result, seconds, (peak - rss_before) / 1024
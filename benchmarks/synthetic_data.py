@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+
+def make_credit_data(n_rows, random_state=42, with_target=True):
+    """
+    Generates a DataFrame shaped like GiveMeSomeCredit/cs-training.csv (without the 'Unnamed: 0'
+    index column): same columns and dtypes, heavy-tailed ratios, the 96/98 past-due codes, missing
+    MonthlyIncome / NumberOfDependents and roughly the same 7% default rate.
+    """
+    rng = np.random.default_rng(random_state)
+
+    revolving_utilization = rng.lognormal(-1.5, 1.2, n_rows)
+    age = rng.normal(52, 15, n_rows).clip(0, 109).round()
+    special_code = rng.random(n_rows) < 0.002
+    past_due_30_59 = np.where(special_code, rng.choice([96, 98], n_rows), rng.poisson(0.25, n_rows))
+    past_due_90 = np.where(special_code, past_due_30_59, rng.poisson(0.1, n_rows))
+    past_due_60_89 = np.where(special_code, past_due_30_59, rng.poisson(0.08, n_rows))
+    open_credit_lines = rng.poisson(8.5, n_rows)
+    real_estate_loans = rng.poisson(1.0, n_rows)
+    # income and dependents depend on the other columns so that imputation has something to learn from
+    dependents = rng.poisson(np.clip(1.6 - np.abs(age - 42) / 25, 0.1, None))
+    log_income = 7.0 + 0.025 * np.minimum(age, 60) + 0.2 * np.minimum(real_estate_loans, 4) + 0.03 * open_credit_lines + rng.normal(0, 0.4, n_rows)
+    monthly_income = np.where(rng.random(n_rows) < 0.2, np.nan, np.exp(log_income).round())
+    debt_ratio = np.where(np.isnan(monthly_income), rng.lognormal(6, 1.5, n_rows), rng.lognormal(-1, 0.8, n_rows))
+    dependents = np.where(rng.random(n_rows) < 0.026, np.nan, dependents)
+
+    dataframe = pd.DataFrame({
+        'SeriousDlqin2yrs': 0,
+        'RevolvingUtilizationOfUnsecuredLines': revolving_utilization,
+        'age': age.astype(np.int64),
+        'NumberOfTime30-59DaysPastDueNotWorse': past_due_30_59,
+        'DebtRatio': debt_ratio,
+        'MonthlyIncome': monthly_income,
+        'NumberOfOpenCreditLinesAndLoans': open_credit_lines,
+        'NumberOfTimes90DaysLate': past_due_90,
+        'NumberRealEstateLoansOrLines': real_estate_loans,
+        'NumberOfTime60-89DaysPastDueNotWorse': past_due_60_89,
+        'NumberOfDependents': dependents,
+    })
+
+    logit = (-3.9 + 1.8 * np.minimum(revolving_utilization, 1.5)
+             + 0.9 * np.minimum(past_due_90, 5) + 0.5 * np.minimum(past_due_30_59, 5)
+             - 0.025 * (age - 52))
+    dataframe['SeriousDlqin2yrs'] = (rng.random(n_rows) < 1 / (1 + np.exp(-logit))).astype(np.int64)
+    if not with_target:
+        dataframe['SeriousDlqin2yrs'] = np.nan
+
+    return dataframe
@@ -0,0 +1,132 @@
+"""
+Converts the GiveMeSomeCredit csv files once into a typed Parquet cache and loads them from there.
+
+Only the columns in RAW_SCHEMA are read (the 'Unnamed: 0' row number is skipped) and every column
+gets a fixed, compact dtype. A cached file records the md5 of its source csv and is rebuilt when
+that changes, e.g. after a `dvc pull` or `dvc checkout` of GiveMeSomeCredit.
+
+    python data_ingest.py GiveMeSomeCredit/cs-training.csv GiveMeSomeCredit/cs-test.csv
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+INGEST_CACHE_DIR = '.ingest_cache'
+
+# bump when RAW_SCHEMA or the conversion changes, so existing cache files are rebuilt
+SCHEMA_VERSION = 1
+
+# Raw columns in csv order. Complete counts get a small integer type (int8 holds the 96/98
+# past-due codes), counts with missing values float32, which holds them exactly, and the ratios
+# and the income stay float64 so their values are unchanged. The target is float32 because it is
+# empty in cs-test.csv.
+RAW_SCHEMA = {
+    'SeriousDlqin2yrs': pa.float32(),
+    'RevolvingUtilizationOfUnsecuredLines': pa.float64(),
+    'age': pa.int16(),
+    'NumberOfTime30-59DaysPastDueNotWorse': pa.int8(),
+    'DebtRatio': pa.float64(),
+    'MonthlyIncome': pa.float64(),
+    'NumberOfOpenCreditLinesAndLoans': pa.int16(),
+    'NumberOfTimes90DaysLate': pa.int8(),
+    'NumberRealEstateLoansOrLines': pa.int8(),
+    'NumberOfTime60-89DaysPastDueNotWorse': pa.int8(),
+    'NumberOfDependents': pa.float32(),
+}
+
+
+def file_md5(path, block_size=2**20):
+    digest = hashlib.md5()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(csv_path, cache_dir=INGEST_CACHE_DIR):
+    return os.path.join(cache_dir, os.path.splitext(os.path.basename(csv_path))[0] + '.parquet')
+
+
+def _source_fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _cached_source(path):
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    source = metadata.get(b'credit_ingest')
+    return json.loads(source) if source else None
+
+
+def is_cache_current(csv_path, cache_dir=INGEST_CACHE_DIR):
+    """
+    True when the cached Parquet file exists, has the current schema version and was built from a
+    csv with the same md5. The md5 is only recomputed when the size or mtime of the csv changed.
+    """
+    cached = _cached_source(cache_path(csv_path, cache_dir))
+    if cached is None or cached.get('schema_version') != SCHEMA_VERSION:
+        return False
+    fingerprint = _source_fingerprint(csv_path)
+    if fingerprint == {'size': cached['size'], 'mtime_ns': cached['mtime_ns']}:
+        return True
+    return fingerprint['size'] == cached['size'] and file_md5(csv_path) == cached['md5']
+
+
+def build_cache(csv_path, cache_dir=INGEST_CACHE_DIR):
+    """
+    Parses csv_path with the fixed RAW_SCHEMA (multi-threaded Arrow csv reader) and writes the typed
+    Parquet file. Raises if a column is missing or a value does not fit its type.
+    """
+    start = time.perf_counter()
+    fingerprint = _source_fingerprint(csv_path)
+    md5 = file_md5(csv_path)
+
+    table = pv.read_csv(csv_path, convert_options=pv.ConvertOptions(column_types=RAW_SCHEMA, include_columns=list(RAW_SCHEMA)))
+    source = {'schema_version': SCHEMA_VERSION, 'source': os.path.basename(csv_path), 'md5': md5, **fingerprint}
+    table = table.replace_schema_metadata({'credit_ingest': json.dumps(source)})
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(csv_path, cache_dir)
+    # write next to the target and rename, so an interrupted build never leaves a partial cache file
+    pq.write_table(table, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+    print(f"Cached {csv_path} ({table.num_rows} rows) -> {path} in {time.perf_counter() - start:.2f}s")
+    return path
+
+
+def load_dataset(csv_path, cache_dir=INGEST_CACHE_DIR, columns=None):
+    """
+    Returns csv_path as a DataFrame with the RAW_SCHEMA dtypes, read from the Parquet cache, which
+    is (re)built first when it is missing or stale. `columns` optionally selects a subset.
+    """
+    if not is_cache_current(csv_path, cache_dir):
+        build_cache(csv_path, cache_dir)
+    return pq.read_table(cache_path(csv_path, cache_dir), columns=columns).to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv', nargs='+', help="GiveMeSomeCredit csv files")
+    parser.add_argument('--cache-dir', default=INGEST_CACHE_DIR)
+    parser.add_argument('--force', action='store_true', help="rebuild even when the cache is current")
+    args = parser.parse_args()
+
+    for csv_path in args.csv:
+        if args.force or not is_cache_current(csv_path, args.cache_dir):
+            build_cache(csv_path, args.cache_dir)
+        else:
+            print(f"{cache_path(csv_path, args.cache_dir)} is current")
+
+
+if __name__ == '__main__':
+    main()
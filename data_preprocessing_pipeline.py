@@ -1,12 +1,263 @@
+import copy
+
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
 from sklearn.experimental import enable_iterative_imputer
-from sklearn.impute import IterativeImputer
+from sklearn.impute import IterativeImputer, KNNImputer, SimpleImputer
+
+TARGET_COLUMN = 'SeriousDlqin2yrs'
+
+# Raw GiveMeSomeCredit column names -> names used by the model and the API
+RENAMED_COLUMNS = {
+    "NumberOfTime30-59DaysPastDueNotWorse": "NumberOfTime30_59DaysPastDueNotWorse",
+    "NumberOfTime60-89DaysPastDueNotWorse": "NumberOfTime60_89DaysPastDueNotWorse"
+}
+
+ORIGINAL_COLUMNS = {renamed: original for original, renamed in RENAMED_COLUMNS.items()}
+
+# 96 and 98 are special codes in the past-due counts, not real counts
+PAST_DUE_COLUMNS = [
+    'NumberOfTime30_59DaysPastDueNotWorse',
+    'NumberOfTimes90DaysLate',
+    'NumberOfTime60_89DaysPastDueNotWorse'
+]
+
+
+IMPUTATION_STRATEGIES = ['iterative_rf', 'iterative_rf_parallel', 'hist_gbm', 'knn', 'median']
+
+
+class MissingColumnsHistGBMImputer(TransformerMixin, BaseEstimator):
+    """
+    Imputes only the columns that have missing values in the training data, each with a
+    HistGradientBoostingRegressor on the other columns. The first round uses the native NaN
+    support of the boosting model, later rounds refit on the imputed values until, for every
+    imputed column, the mean change of its imputed values is below `tol` times the mean absolute
+    observed value of that column, or the change has stopped shrinking by at least 10% per round
+    (refitting noise keeps it from reaching zero), or `max_iter` rounds ran.
+    Columns that were complete during fit are filled with their training median.
+    """
+
+    def __init__(self, max_iter=10, tol=1e-3, random_state=None):
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_state = random_state
+
+    def _predict_round(self, values, missing, round_estimators):
+        for column, estimator in round_estimators:
+            rows = missing[:, column]
+            if rows.any():
+                values[rows, column] = estimator.predict(np.delete(values[rows], column, axis=1))
+
+    def fit(self, X, y=None):
+        self.fit_transform(X)
+        return self
+
+    def fit_transform(self, X, y=None):
+        values = np.array(X, dtype=np.float64)
+        missing = np.isnan(values)
+
+        self.n_features_in_ = values.shape[1]
+        self.fill_values_ = np.nanmedian(values, axis=0)
+        self.imputed_columns_ = np.flatnonzero(missing.any(axis=0))
+        self.estimators_ = []
+        previous_change = np.full(len(self.imputed_columns_), np.inf)
+        column_scale = np.array([np.mean(np.abs(values[~missing[:, column], column])) for column in self.imputed_columns_])
+
+        for _ in range(self.max_iter):
+            previous = values.copy()
+            round_estimators = []
+            for column in self.imputed_columns_:
+                observed = ~missing[:, column]
+                estimator = HistGradientBoostingRegressor(random_state=self.random_state)
+                estimator.fit(np.delete(values[observed], column, axis=1), values[observed, column])
+                round_estimators.append((column, estimator))
+                self._predict_round(values, missing, [(column, estimator)])
+            self.estimators_.append(round_estimators)
+
+            if len(self.estimators_) > 1:
+                change = np.array([np.mean(np.abs(values[missing[:, column], column] - previous[missing[:, column], column])) for column in self.imputed_columns_])
+                if np.all(change < self.tol * column_scale) or np.all(change > 0.9 * previous_change):
+                    break
+                previous_change = change
+
+        self.n_iter_ = len(self.estimators_)
+        return self._fill_remaining(values)
+
+    def _fill_remaining(self, values):
+        remaining = np.isnan(values)
+        if remaining.any():
+            values[remaining] = np.take(self.fill_values_, np.nonzero(remaining)[1])
+        return values
+
+    def transform(self, X):
+        values = np.array(X, dtype=np.float64)
+        missing = np.isnan(values)
+        for round_estimators in self.estimators_:
+            self._predict_round(values, missing, round_estimators)
+        return self._fill_remaining(values)
+
+
+def build_imputer(strategy='iterative_rf', max_iter=10, tol=1e-3, random_state=42):
+    """
+    Returns an unfitted imputer for one of IMPUTATION_STRATEGIES:
+
+    - iterative_rf: IterativeImputer with a single-threaded RandomForestRegressor over every column (original behaviour)
+    - iterative_rf_parallel: the same forest on all cores, fitted only for columns that have missing values
+    - hist_gbm: MissingColumnsHistGBMImputer
+    - knn: KNNImputer with 5 neighbours
+    - median: SimpleImputer with the column median
+    """
+    if strategy == 'iterative_rf':
+        return IterativeImputer(estimator=RandomForestRegressor(n_estimators=10, random_state=random_state, n_jobs=1), max_iter=max_iter, tol=tol, random_state=random_state)
+    if strategy == 'iterative_rf_parallel':
+        return IterativeImputer(estimator=RandomForestRegressor(n_estimators=10, random_state=random_state, n_jobs=-1), max_iter=max_iter, tol=tol, random_state=random_state, skip_complete=True)
+    if strategy == 'hist_gbm':
+        return MissingColumnsHistGBMImputer(max_iter=max_iter, tol=tol, random_state=random_state)
+    if strategy == 'knn':
+        return KNNImputer(n_neighbors=5)
+    if strategy == 'median':
+        return SimpleImputer(strategy='median')
+    raise ValueError(f"Unknown imputation strategy '{strategy}', expected one of {IMPUTATION_STRATEGIES}")
+
+
+class CreditDataPreprocessor(TransformerMixin, BaseEstimator):
+    """
+    Learns the outlier caps, replacement medians and the IterativeImputer from the training data
+    and applies them to any other data. Accepts both the raw column names of the GiveMeSomeCredit
+    csv files and the renamed ones the model and the API use. The target column, when present,
+    is passed through and is not used for imputation.
+
+    `imputation_strategy` selects the imputer, see build_imputer(). `imputation_max_iter` and
+    `imputation_tol` control early stopping of the iterative strategies.
+    """
+
+    def __init__(self, target_column=TARGET_COLUMN, imputation_strategy='iterative_rf', imputation_max_iter=10, imputation_tol=1e-3, random_state=42):
+        self.target_column = target_column
+        self.imputation_strategy = imputation_strategy
+        self.imputation_max_iter = imputation_max_iter
+        self.imputation_tol = imputation_tol
+        self.random_state = random_state
+
+    def _source_columns(self, dataframe, columns):
+        if not isinstance(dataframe, pd.DataFrame):
+            raise TypeError("Input should be a pandas DataFrame object")
+        return [column if column in dataframe.columns else ORIGINAL_COLUMNS.get(column, column) for column in columns]
+
+    def _feature_values(self, dataframe):
+        # one column-major float64 copy of the feature block, filled column by column so no
+        # intermediate frame is built; every later step works on it in place
+        source_columns = self._source_columns(dataframe, self.feature_names_in_)
+        values = np.empty((len(dataframe), len(source_columns)), dtype=np.float64, order='F')
+        for position, column in enumerate(source_columns):
+            values[:, position] = dataframe[column].to_numpy()
+        return values
+
+    def _fit(self, dataframe):
+        feature_columns = [RENAMED_COLUMNS.get(column, column) for column in dataframe.columns if column != self.target_column]
+        self.feature_names_in_ = np.array(feature_columns, dtype=object)
+        self.n_features_in_ = len(self.feature_names_in_)
+        values = self._feature_values(dataframe)
+        column = self._column_positions()
+
+        self.revolving_utilization_upper_cap_ = np.nanquantile(values[:, column['RevolvingUtilizationOfUnsecuredLines']], 0.99)
+        self.age_median_ = np.nanmedian(values[:, column['age']])
+        self.past_due_medians_ = {name: np.nanmedian(values[:, column[name]]) for name in PAST_DUE_COLUMNS}
+
+        self._replace_outliers(values)
+
+        self.imputer_ = build_imputer(self.imputation_strategy, max_iter=self.imputation_max_iter, tol=self.imputation_tol, random_state=self.random_state)
+        values = self.imputer_.fit_transform(values)
+
+        self.monthly_income_upper_cap_ = np.quantile(np.maximum(values[:, column['MonthlyIncome']], 0), 0.99)
+        self.debt_ratio_upper_cap_ = np.quantile(values[:, column['DebtRatio']], 0.99)
+
+        self._cap_after_imputation(values)
+        return self._to_dataframe(dataframe, values)
+
+    def _column_positions(self):
+        return {name: position for position, name in enumerate(self.feature_names_in_)}
+
+    def _replace_outliers(self, values):
+        """
+        Clips RevolvingUtilizationOfUnsecuredLines, replaces ages below 18 and the 96/98 past-due codes
+        with the training medians. Works in place on the float64 feature matrix; NaNs are left alone.
+        """
+        column = self._column_positions()
+
+        revolving_utilization = values[:, column['RevolvingUtilizationOfUnsecuredLines']]
+        np.minimum(revolving_utilization, self.revolving_utilization_upper_cap_, out=revolving_utilization)
+
+        age = values[:, column['age']]
+        age[age < 18] = self.age_median_
+
+        for name in PAST_DUE_COLUMNS:
+            past_due = values[:, column[name]]
+            past_due[(past_due == 98) | (past_due == 96)] = self.past_due_medians_[name]
+
+    def _cap_after_imputation(self, values):
+        """
+        Caps MonthlyIncome, DebtRatio and NumberRealEstateLoansOrLines in place on the feature matrix.
+        """
+        column = self._column_positions()
+
+        monthly_income = values[:, column['MonthlyIncome']]
+        np.clip(monthly_income, 0, self.monthly_income_upper_cap_, out=monthly_income)
+
+        debt_ratio = values[:, column['DebtRatio']]
+        np.minimum(debt_ratio, self.debt_ratio_upper_cap_, out=debt_ratio)
+
+        real_estate_loans = values[:, column['NumberRealEstateLoansOrLines']]
+        np.minimum(real_estate_loans, 17, out=real_estate_loans)
+
+    def _to_dataframe(self, dataframe, values):
+        output = pd.DataFrame(values, columns=self.feature_names_in_, index=dataframe.index, copy=False)
+        if self.target_column in dataframe.columns:
+            output.insert(list(dataframe.columns).index(self.target_column), self.target_column, dataframe[self.target_column].astype(float))
+        return output
+
+    def fit(self, X, y=None):
+        self._fit(X)
+        return self
+
+    def fit_transform(self, X, y=None):
+        return self._fit(X)
+
+    def without_imputer(self):
+        """
+        Returns a copy of the fitted preprocessor without the (large) imputer, for data that never
+        has missing values, such as validated API requests. Its transform() raises on NaNs.
+        """
+        serving_preprocessor = copy.copy(self)
+        serving_preprocessor.imputer_ = None
+        return serving_preprocessor
+
+    def transform_array(self, values):
+        """
+        Transforms a float64 matrix whose columns are in feature_names_in_ order, in place when no
+        value is missing, without building a DataFrame. Returns the transformed matrix.
+        """
+        self._replace_outliers(values)
+
+        # the imputer is only needed when something is actually missing
+        if np.isnan(values).any():
+            if self.imputer_ is None:
+                raise ValueError("Input contains missing values, but this preprocessor was saved without its imputer")
+            values = self.imputer_.transform(values)
+
+        self._cap_after_imputation(values)
+        return values
+
+    def transform(self, X):
+        values = self.transform_array(self._feature_values(X))
+        return self._to_dataframe(X, values)
+
 
 def wrangle(training_dataframe, testing_dataframe):
     """
     Applies the full data preprocessing pipeline to both training and testing DataFrames.
+    Returns the processed DataFrames; use CreditDataPreprocessor directly to keep the fitted state.
     """
     try:
         is_df = isinstance(training_dataframe, pd.DataFrame) and isinstance(testing_dataframe, pd.DataFrame)
@@ -18,53 +269,8 @@ def wrangle(training_dataframe, testing_dataframe):
         print("Pandas is not imported.")
         return training_dataframe, testing_dataframe
 
-    RevolvingUtilizationOfUnsecuredLines_uppercap = training_dataframe['RevolvingUtilizationOfUnsecuredLines'].quantile(0.99)
-    training_dataframe['RevolvingUtilizationOfUnsecuredLines'] = training_dataframe['RevolvingUtilizationOfUnsecuredLines'].clip(upper=RevolvingUtilizationOfUnsecuredLines_uppercap)
-    testing_dataframe['RevolvingUtilizationOfUnsecuredLines'] = testing_dataframe['RevolvingUtilizationOfUnsecuredLines'].clip(upper=RevolvingUtilizationOfUnsecuredLines_uppercap)
-
-    mean_age = training_dataframe['age'].median()
-    training_dataframe['age'] = training_dataframe['age'].apply(lambda x: mean_age if x < 18 else x)
-    testing_dataframe['age'] = testing_dataframe['age'].apply(lambda x: mean_age if x < 18 else x)
-
-    NumberOfTime30to59DaysPastDueNotWorse_median = training_dataframe['NumberOfTime30-59DaysPastDueNotWorse'].median()
-    training_dataframe["NumberOfTime30-59DaysPastDueNotWorse"] = training_dataframe['NumberOfTime30-59DaysPastDueNotWorse'].replace([98, 96], NumberOfTime30to59DaysPastDueNotWorse_median)
-    testing_dataframe["NumberOfTime30-59DaysPastDueNotWorse"] = testing_dataframe['NumberOfTime30-59DaysPastDueNotWorse'].replace([98, 96], NumberOfTime30to59DaysPastDueNotWorse_median)
-    
-    NumberOfTimes90DaysLate_median = training_dataframe['NumberOfTimes90DaysLate'].median()
-    training_dataframe["NumberOfTimes90DaysLate"] = training_dataframe['NumberOfTimes90DaysLate'].replace([98, 96], NumberOfTimes90DaysLate_median)
-    testing_dataframe["NumberOfTimes90DaysLate"] = testing_dataframe['NumberOfTimes90DaysLate'].replace([98, 96], NumberOfTimes90DaysLate_median)
-
-    NumberOfTime60to89DaysPastDueNotWorse_median = training_dataframe['NumberOfTime60-89DaysPastDueNotWorse'].median()
-    training_dataframe["NumberOfTime60-89DaysPastDueNotWorse"] = training_dataframe['NumberOfTime60-89DaysPastDueNotWorse'].replace([98, 96], NumberOfTime60to89DaysPastDueNotWorse_median)
-    testing_dataframe["NumberOfTime60-89DaysPastDueNotWorse"] = testing_dataframe['NumberOfTime60-89DaysPastDueNotWorse'].replace([98, 96], NumberOfTime60to89DaysPastDueNotWorse_median)
-
-    imputer = IterativeImputer(estimator=RandomForestRegressor(n_estimators=10, random_state=42, n_jobs=1), max_iter=10, random_state=42)
-    training_dataframe_imputed_values = imputer.fit_transform(training_dataframe)
-    testing_dataframe_imputed_values = imputer.transform(testing_dataframe)
-    training_dataframe = pd.DataFrame(training_dataframe_imputed_values, columns=training_dataframe.columns)
-    testing_dataframe = pd.DataFrame(testing_dataframe_imputed_values, columns=testing_dataframe.columns)
-
-    training_dataframe['MonthlyIncome'] = training_dataframe['MonthlyIncome'].clip(lower=0)
-    testing_dataframe['MonthlyIncome'] = testing_dataframe['MonthlyIncome'].clip(lower=0)
-    
-    monthly_income_upper_cap = training_dataframe['MonthlyIncome'].quantile(0.99)
-    training_dataframe['MonthlyIncome'] = training_dataframe['MonthlyIncome'].clip(upper=monthly_income_upper_cap)
-    testing_dataframe['MonthlyIncome'] = testing_dataframe['MonthlyIncome'].clip(upper=monthly_income_upper_cap)
-
-    upper_cap_debt_ratio = training_dataframe['DebtRatio'].quantile(0.99)
-    training_dataframe['DebtRatio'] = training_dataframe['DebtRatio'].clip(upper=upper_cap_debt_ratio)
-    testing_dataframe['DebtRatio'] = testing_dataframe['DebtRatio'].clip(upper=upper_cap_debt_ratio)
-
-    training_dataframe['NumberRealEstateLoansOrLines'] = training_dataframe['NumberRealEstateLoansOrLines'].clip(upper=17)
-    testing_dataframe['NumberRealEstateLoansOrLines'] = testing_dataframe['NumberRealEstateLoansOrLines'].clip(upper=17)
-
-    training_dataframe.rename(columns={
-        "NumberOfTime30-59DaysPastDueNotWorse": "NumberOfTime30_59DaysPastDueNotWorse", 
-        "NumberOfTime60-89DaysPastDueNotWorse": "NumberOfTime60_89DaysPastDueNotWorse"
-    }, inplace=True)
-    testing_dataframe.rename(columns={
-        "NumberOfTime30-59DaysPastDueNotWorse": "NumberOfTime30_59DaysPastDueNotWorse", 
-        "NumberOfTime60-89DaysPastDueNotWorse": "NumberOfTime60_89DaysPastDueNotWorse"
-    }, inplace=True)
-    
+    preprocessor = CreditDataPreprocessor()
+    training_dataframe = preprocessor.fit_transform(training_dataframe)
+    testing_dataframe = preprocessor.transform(testing_dataframe)
+
     return training_dataframe, testing_dataframe
@@ -0,0 +1,230 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from collections import deque
+
+import joblib
+import numpy as np
+
+# Drift of the served inputs and predictions from the training data, measured on fixed bins.
+#
+# The reference profile, saved at training time, holds for every model feature and for the
+# predicted probability the cut points of (up to) n_bins quantile bins and the training counts of
+# every bin. Live rows are counted into the same bins, so a worker's state is a small integer array
+# per column whatever the traffic, and the states of several workers merge by adding them up.
+#
+# Each column has len(cuts) + 2 bins: value < cuts[0], then one bin per [cuts[k], cuts[k + 1]),
+# value >= cuts[-1], and a last bin for missing values.
+
+PROBABILITY_COLUMN = 'probability_of_default'
+# proportions are floored here before the logarithm of the PSI, so an empty bin stays finite
+PSI_EPSILON = 1e-4
+# the usual reading of the PSI: below 0.1 stable, up to 0.25 a moderate shift, above that a major one
+PSI_THRESHOLDS = (0.1, 0.25)
+
+
+def _sorted_bin_counts(sorted_values, cuts):
+    # NaN sorts last, so the values below every cut are a prefix of the sorted values
+    n_present = np.searchsorted(sorted_values, np.nan)
+    below = np.searchsorted(sorted_values[:n_present], cuts, side='left')
+    return np.diff(np.concatenate([[0], below, [n_present, len(sorted_values)]]))
+
+
+def _bin_counts(values, cuts):
+    return _sorted_bin_counts(np.sort(np.asarray(values, dtype=np.float64)), cuts)
+
+
+def build_reference(features, probabilities, n_bins=20):
+    """
+    Reference profile of the preprocessed training features (a DataFrame) and of predicted
+    probabilities of default. The two may come from different rows: out-of-sample probabilities
+    (of a validation split) describe served predictions better than in-sample ones.
+    """
+    columns = {str(name): features[name].to_numpy(dtype=np.float64) for name in features.columns}
+    columns[PROBABILITY_COLUMN] = np.asarray(probabilities, dtype=np.float64)
+
+    reference = {'columns': [], 'cuts': [], 'counts': []}
+    quantiles = np.linspace(0, 1, n_bins + 1)[1:-1]
+    for name, values in columns.items():
+        # a discrete feature has repeated quantiles and so fewer, wider bins
+        cuts = np.unique(np.nanquantile(values, quantiles)) if not np.isnan(values).all() else np.array([])
+        reference['columns'].append(name)
+        reference['cuts'].append(cuts.tolist())
+        reference['counts'].append(_bin_counts(values, cuts).tolist())
+    return reference
+
+
+def save_reference(reference, path='drift_reference.json'):
+    with open(path, 'w') as f:
+        json.dump(reference, f)
+
+
+def load_reference(path='drift_reference.json'):
+    with open(path) as f:
+        return json.load(f)
+
+
+def merge_snapshots(snapshots):
+    """
+    Adds up DriftMonitor.snapshot() results taken against the same reference profile.
+    """
+    snapshots = list(snapshots)
+    if len({snapshot['reference'] for snapshot in snapshots}) > 1:
+        raise ValueError("Snapshots taken against different reference profiles cannot be merged")
+    return {
+        'reference': snapshots[0]['reference'],
+        'rows': sum(snapshot['rows'] for snapshot in snapshots),
+        'counts': [np.sum(column, axis=0).tolist() for column in zip(*(snapshot['counts'] for snapshot in snapshots))],
+        'workers': sum(snapshot.get('workers', 1) for snapshot in snapshots),
+    }
+
+
+def drift_statistics(reference_counts, counts):
+    """
+    (PSI, KS) of the binned distribution `counts` against `reference_counts`. KS is the largest
+    gap between the two cumulative distributions at the bin edges, so it is a lower bound of the
+    KS statistic of the unbinned values.
+    """
+    reference = np.asarray(reference_counts, dtype=np.float64)
+    current = np.asarray(counts, dtype=np.float64)
+    if current.sum() == 0 or reference.sum() == 0:
+        return None, None
+    reference, current = reference / reference.sum(), current / current.sum()
+
+    floored_reference, floored_current = np.maximum(reference, PSI_EPSILON), np.maximum(current, PSI_EPSILON)
+    psi = float(np.sum((floored_current - floored_reference) * np.log(floored_current / floored_reference)))
+    ks = float(np.max(np.abs(np.cumsum(current) - np.cumsum(reference))))
+    return psi, ks
+
+
+class DriftMonitor:
+    """
+    Counts served feature rows and probabilities into the bins of a reference profile.
+
+    update() only keeps a reference to the scored batch. Once buffer_rows rows are held, after
+    flush_seconds or when a snapshot is taken, they are counted in one vectorized pass: every
+    column is sorted and the cut points are looked up in it. Memory is bounded by buffer_rows rows
+    plus one count per bin, whatever the traffic.
+
+    With snapshot_dir set, every flush also writes the worker's counts to drift_<pid>.json there,
+    and report() merges the snapshots of all the workers that share the directory. Snapshots not
+    rewritten for snapshot_max_age_seconds, those of workers that have exited, are left out.
+    """
+
+    def __init__(self, reference, buffer_rows=4096, flush_seconds=10.0, snapshot_dir=None, snapshot_max_age_seconds=86400.0):
+        self.columns = list(reference['columns'])
+        self.feature_columns = [name for name in self.columns if name != PROBABILITY_COLUMN]
+        self._cuts = [np.asarray(cuts, dtype=np.float64) for cuts in reference['cuts']]
+        self.reference_counts = [np.asarray(counts, dtype=np.int64) for counts in reference['counts']]
+        self.reference_version = joblib.hash((reference['columns'], reference['cuts']))
+        self.flush_seconds = flush_seconds
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_max_age_seconds = snapshot_max_age_seconds
+
+        self.buffer_rows = buffer_rows
+        self._feature_positions = [self.columns.index(name) for name in self.feature_columns]
+        self._probability_position = self.columns.index(PROBABILITY_COLUMN)
+        self._pending = deque()
+        # only decides when to flush, so an increment lost to a concurrent update does no harm
+        self._pending_rows = 0
+        self._counts = [np.zeros(len(cuts) + 2, dtype=np.int64) for cuts in self._cuts]
+        self.rows = 0
+        self._flushed_at = time.monotonic()
+        self._flush_lock = threading.Lock()
+
+        if snapshot_dir:
+            os.makedirs(snapshot_dir, exist_ok=True)
+
+    def update(self, features, probabilities):
+        """
+        Records a scored batch: a float array of features of shape (n_rows, n_features) in the
+        reference's feature order, and the n_rows predicted probabilities. The arrays are kept until
+        the next flush and must not be modified in the meantime.
+        """
+        # no lock on this path: deque.append is atomic, and only one thread flushes at a time
+        self._pending.append((features, probabilities))
+        self._pending_rows += len(features)
+        if self._pending_rows >= self.buffer_rows or time.monotonic() - self._flushed_at > self.flush_seconds:
+            if self._flush_lock.acquire(blocking=False):
+                try:
+                    self._flush()
+                finally:
+                    self._flush_lock.release()
+
+    def _flush(self):
+        self._pending_rows = 0
+        self._flushed_at = time.monotonic()
+        batches = [self._pending.popleft() for _ in range(len(self._pending))]
+        if batches:
+            features = np.sort(np.concatenate([features for features, _ in batches]), axis=0)
+            probabilities = np.sort(np.concatenate([probabilities for _, probabilities in batches]))
+            for position, column in enumerate(self._feature_positions):
+                self._counts[column] += _sorted_bin_counts(features[:, position], self._cuts[column])
+            self._counts[self._probability_position] += _sorted_bin_counts(probabilities, self._cuts[self._probability_position])
+            self.rows += len(probabilities)
+        if self.snapshot_dir:
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        path = os.path.join(self.snapshot_dir, f"drift_{os.getpid()}.json")
+        # written under a temporary name and renamed, so other workers never read half a file
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def _snapshot(self):
+        return {'reference': self.reference_version, 'rows': self.rows, 'counts': [counts.tolist() for counts in self._counts]}
+
+    def snapshot(self):
+        """
+        The counts of this worker, including the rows still in the buffer.
+        """
+        with self._flush_lock:
+            self._flush()
+            return self._snapshot()
+
+    def collect(self):
+        """
+        This worker's snapshot merged with those the other workers wrote to snapshot_dir. Snapshots
+        of another reference profile (an earlier model) and stale ones are skipped.
+        """
+        snapshots = [self.snapshot()]
+        if self.snapshot_dir:
+            own = os.path.join(self.snapshot_dir, f"drift_{os.getpid()}.json")
+            for path in sorted(glob.glob(os.path.join(self.snapshot_dir, 'drift_*.json'))):
+                if path == own:
+                    continue
+                try:
+                    # a worker that has exited leaves its last snapshot behind
+                    if self.snapshot_max_age_seconds is not None and time.time() - os.path.getmtime(path) > self.snapshot_max_age_seconds:
+                        continue
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if snapshot.get('reference') == self.reference_version:
+                    snapshots.append(snapshot)
+        return merge_snapshots(snapshots)
+
+    def report(self, snapshot=None):
+        """
+        PSI and KS of every feature and of the predicted probability against the reference, for
+        `snapshot` or by default for all the workers (see collect).
+        """
+        snapshot = snapshot or self.collect()
+        low, high = PSI_THRESHOLDS
+        columns = {}
+        for name, reference_counts, counts in zip(self.columns, self.reference_counts, snapshot['counts']):
+            psi, ks = drift_statistics(reference_counts, counts)
+            status = None if psi is None else 'stable' if psi < low else 'moderate' if psi < high else 'major'
+            columns[name] = {'psi': psi, 'ks': ks, 'status': status}
+
+        return {
+            'rows': snapshot['rows'],
+            'workers': snapshot['workers'],
+            'features': {name: columns[name] for name in self.feature_columns},
+            'prediction': columns[PROBABILITY_COLUMN],
+        }
@@ -1,22 +1,393 @@
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from email.message import Message
+from fastapi import FastAPI, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import TypeAdapter, ValidationError
 import pandas as pd
+import numpy as np
+import asyncio
 import joblib
-
-from pydantic_model import UserInput
+import json
+import os
+import threading
+import time
 
 try:
-    model = joblib.load('stacking_model.joblib')
-    print("Stacking model loaded successfully.")
-except FileNotFoundError:
-    model = None
-    print("Error: stacking_model.pkl not found. Make sure the file is in the same directory.")
+    import orjson
+except ImportError:  # optional, responses fall back to the stdlib json encoder
+    orjson = None
+
+from pydantic_model import UserInput, BatchUserInput, MODEL_FEATURES
+from micro_batching import MicroBatcher
+from tree_compiler import CompiledStackingModel, compile_stacking_model
+from tree_explainer import TreeShapExplainer
+from prediction_cache import PredictionCache
+from drift_monitor import DriftMonitor, load_reference
+from latency_metrics import LatencyMetrics, RequestMetricsMiddleware
+from sampling_profiler import SamplingProfiler
+
+# MODEL_ENGINE=compiled serves the NumPy-only export written by model_training_pipeline.training
+MODEL_ENGINE = os.getenv('MODEL_ENGINE', 'joblib')
+MODEL_PATH = 'stacking_model_compiled' if MODEL_ENGINE == 'compiled' else 'stacking_model.joblib'
+# validated requests never have missing values, so the copy without the imputer is enough
+PREPROCESSOR_PATH = 'preprocessor_serving.joblib' if os.path.exists('preprocessor_serving.joblib') else 'preprocessor.joblib'
+# MODEL_LOADING=eager loads at import time, so a pre-forking server (gunicorn --preload) loads once
+# and shares the pages with its workers; MODEL_LOADING=background starts serving /health at once
+# and loads in a thread, /ready turns green when the model is resident
+MODEL_LOADING = os.getenv('MODEL_LOADING', 'eager')
+# REASON_CODES=1 allows ?reasons=k; the TreeSHAP explainer behind it is built by the first request
+# that asks for reasons, and its pattern tables take up to REASON_CODES_TABLE_MB per worker
+REASON_CODES = os.getenv('REASON_CODES', '1') == '1'
+REASON_CODES_TABLE_MB = float(os.getenv('REASON_CODES_TABLE_MB', 256))
+# scored rows are compared with the training profile written by main_file.py; with several workers,
+# point DRIFT_SNAPSHOT_DIR at a directory they share so /monitoring/drift reports all of them
+DRIFT_REFERENCE_PATH = os.getenv('DRIFT_REFERENCE_PATH', 'drift_reference.json')
+DRIFT_SNAPSHOT_DIR = os.getenv('DRIFT_SNAPSHOT_DIR') or None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse encoded with orjson when it is installed; the output is the same compact JSON.
+    NumPy arrays and scalars are serialized as their Python values, as the stdlib encoder did for
+    NumPy floats.
+    """
+
+    def render(self, content):
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY, default=_to_builtin)
+
+
+def _to_builtin(value):
+    # orjson calls this for types it does not know, such as NumPy scalars it leaves out
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+model = None
+preprocessor = None
+explainer = None
+explainer_error = None
+explainer_lock = threading.Lock()
+drift_monitor = None
+model_status = {'ready': False, 'engine': MODEL_ENGINE, 'load_seconds': None, 'error': None, 'reason_codes': False, 'drift_monitoring': False}
+
+
+def load_model():
+    """
+    Loads the model and the preprocessor, binds the prediction cache to them and scores one warm-up
+    row so that memory-mapped arrays are paged in before the model is reported ready. The drift
+    monitor is started when the reference profile is found.
+    """
+    global model, preprocessor, drift_monitor
+    start = time.perf_counter()
+
+    try:
+        if MODEL_ENGINE == 'compiled':
+            model = CompiledStackingModel.load(MODEL_PATH, mmap=True)
+            model.touch()
+        else:
+            model = joblib.load(MODEL_PATH)
+        print("Stacking model loaded successfully.")
+    except FileNotFoundError:
+        model = None
+        model_status['error'] = f"{MODEL_PATH} not found"
+        print("Error: stacking model not found. Make sure the file is in the same directory.")
+    except Exception as e:
+        # a truncated or corrupt artifact; with MODEL_LOADING=background this thread would
+        # otherwise die and leave /ready at 'loading'
+        model = None
+        model_status['error'] = f"{MODEL_PATH} could not be loaded: {type(e).__name__}: {e}"
+        print(f"Error: {model_status['error']}")
+
+    # caps, medians and imputer fitted on the training data by main_file.py
+    try:
+        preprocessor = joblib.load(PREPROCESSOR_PATH)
+        print("Preprocessor loaded successfully.")
+    except FileNotFoundError:
+        preprocessor = None
+        print(f"Warning: {PREPROCESSOR_PATH} not found. Inputs are scored without preprocessing.")
+    except Exception as e:
+        # scoring without the preprocessor the model was trained with would give wrong probabilities
+        preprocessor = None
+        model_status['error'] = f"{PREPROCESSOR_PATH} could not be loaded: {type(e).__name__}: {e}"
+        print(f"Error: {model_status['error']}")
+        return
+
+    # only clears entries when load_model runs again in the same process; the files are not watched
+    prediction_cache.bind(artifact_version(MODEL_PATH, PREPROCESSOR_PATH))
+
+    # feature matrices are built in MODEL_FEATURES order and handed to the preprocessor as they are
+    if preprocessor is not None and list(preprocessor.feature_names_in_) != MODEL_FEATURES:
+        model_status['error'] = f"{PREPROCESSOR_PATH} was fitted on the columns {list(preprocessor.feature_names_in_)}, expected {MODEL_FEATURES}"
+        print(f"Error: {model_status['error']}")
+        return
+
+    if model is not None:
+        try:
+            predict_probabilities([np.zeros(len(MODEL_FEATURES))], cache=False)
+        except Exception as e:
+            model_status['error'] = f"warm-up prediction failed: {e}"
+            print(f"Error: {model_status['error']}")
+            return
+
+        # started after the warm-up row, which is not traffic
+        try:
+            reference = load_reference(DRIFT_REFERENCE_PATH)
+            if reference['columns'][:-1] != MODEL_FEATURES:
+                raise ValueError(f"it was built on the columns {reference['columns'][:-1]}, expected {MODEL_FEATURES}")
+            drift_monitor = DriftMonitor(
+                reference,
+                buffer_rows=int(os.getenv('DRIFT_BUFFER_ROWS', 4096)),
+                flush_seconds=float(os.getenv('DRIFT_FLUSH_SECONDS', 10)),
+                snapshot_dir=DRIFT_SNAPSHOT_DIR,
+                snapshot_max_age_seconds=float(os.getenv('DRIFT_SNAPSHOT_MAX_AGE_SECONDS', 86400))
+            )
+            model_status['drift_monitoring'] = True
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Warning: drift monitoring is off, {DRIFT_REFERENCE_PATH}: {e}")
+
+        model_status['load_seconds'] = round(time.perf_counter() - start, 3)
+        model_status['ready'] = True
+        print(f"Model ready after {model_status['load_seconds']}s.")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if MODEL_LOADING == 'background' and not model_status['ready']:
+        threading.Thread(target=load_model, daemon=True).start()
+    yield
+
 
 app = FastAPI(
     title="Credit Risk Prediction API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
+)
+
+
+def _finite_json(value):
+    # NaN and Infinity are not valid JSON, so an echoed input holding them is reported as null
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _finite_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_finite_json(item) for item in value]
+    return value
+
+
+@app.exception_handler(RequestValidationError)
+async def request_validation_error(request, exc):
+    # FastAPI's own 422 body, except that a NaN or Infinity sent in the request no longer turns
+    # the error response into a 500
+    return FastJSONResponse(status_code=422, content={'detail': _finite_json(jsonable_encoder(exc.errors()))})
+
+
+user_input_list_adapter = TypeAdapter(list[UserInput])
+
+# Per-stage latency histograms and request counters, served by /metrics
+latency_metrics = LatencyMetrics()
+app.add_middleware(RequestMetricsMiddleware, metrics=latency_metrics, paths=['/predict', '/predict/batch'])
+
+# Sampling profiler, switched on and off at runtime through /debug/profiling (or PROFILING=1 at start)
+profiler = SamplingProfiler(interval_ms=float(os.getenv('PROFILING_INTERVAL_MS', 5)))
+if os.getenv('PROFILING', '0') == '1':
+    profiler.start()
+
+
+def artifact_version(*paths):
+    """
+    Fingerprint of the model artifacts on disk (path, size and modification time of every file).
+    """
+    files = [os.path.join(path, name) for path in paths if os.path.isdir(path) for name in sorted(os.listdir(path))]
+    files += [path for path in paths if os.path.isfile(path)]
+    stats = [(path, os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in files]
+    return joblib.hash(stats)
+
+
+# Repeated applicants are answered from memory, see prediction_cache.PredictionCache
+prediction_cache = PredictionCache(
+    maxsize=int(os.getenv('PREDICTION_CACHE_SIZE', 10_000)),
+    ttl_seconds=float(os.getenv('PREDICTION_CACHE_TTL_SECONDS', 300))
 )
 
+
+def feature_row(item):
+    """
+    Model features of a validated UserInput, in MODEL_FEATURES order.
+    """
+    return PredictionCache.key(getattr(item, feature) for feature in MODEL_FEATURES)
+
+
+def build_feature_matrix(rows):
+    """
+    Fills one float64 matrix with the feature rows (see feature_row) and applies the fitted
+    training preprocessing to it in place. Only the joblib model, whose sklearn estimators check
+    the column names they were fitted with, gets it wrapped in a DataFrame (without a copy).
+    """
+    matrix = np.array(rows, dtype=np.float64).reshape(-1, len(MODEL_FEATURES))
+    if preprocessor is not None:
+        matrix = preprocessor.transform_array(matrix)
+    if isinstance(model, CompiledStackingModel):
+        return matrix
+    return pd.DataFrame(matrix, columns=MODEL_FEATURES, copy=False)
+
+
+def is_json_content_type(content_type):
+    """
+    Whether FastAPI would parse a body with this Content-Type header as JSON (application/json or
+    application/*+json). Without the header it does not.
+    """
+    if not content_type:
+        return False
+    message = Message()
+    message['content-type'] = content_type
+    subtype = message.get_content_subtype()
+    return message.get_content_maintype() == 'application' and (subtype == 'json' or subtype.endswith('+json'))
+
+
+def parse_user_input(body, content_type='application/json'):
+    """
+    Validates a raw /predict request body into a UserInput. Invalid bodies raise the same
+    RequestValidationError (and so the same 422 response) as a `data: UserInput` parameter would.
+    """
+    if body and not is_json_content_type(content_type):
+        # FastAPI hands a body of any other content type to the model as bytes, which fail validation
+        payload = body
+    else:
+        try:
+            # fast path: pydantic parses and validates the JSON bytes in one pass
+            return UserInput.model_validate_json(body)
+        except ValidationError:
+            pass
+
+        # the body is invalid (or uses JSON that only the stdlib parser accepts, such as NaN): take
+        # the same steps as FastAPI so the error is reported exactly as before
+        try:
+            payload = json.loads(body) if body else None
+        except json.JSONDecodeError as e:
+            raise RequestValidationError([{'type': 'json_invalid', 'loc': ('body', e.pos), 'msg': 'JSON decode error', 'input': {}, 'ctx': {'error': e.msg}}], body=e.doc)
+    if payload is None:
+        raise RequestValidationError([{'type': 'missing', 'loc': ('body',), 'msg': 'Field required', 'input': None}])
+    try:
+        # FastAPI validates body models with from_attributes=True, which decides the error type of non-objects
+        return UserInput.model_validate(payload, from_attributes=True)
+    except ValidationError as e:
+        raise RequestValidationError([{**error, 'loc': ('body', *error['loc'])} for error in e.errors(include_url=False)], body=payload)
+
+
+def validate_records(records):
+    """
+    Validates a list of raw records in one pass. Returns the valid records as {index: UserInput}
+    and the per-record validation errors as {index: [error, ...]}.
+    """
+    try:
+        return dict(enumerate(user_input_list_adapter.validate_python(records))), {}
+    except ValidationError as e:
+        errors = {}
+        for error in e.errors(include_url=False):
+            index = error['loc'][0]
+            errors.setdefault(index, []).append({'loc': list(error['loc'][1:]), 'msg': error['msg'], 'type': error['type']})
+
+    valid_indices = [index for index in range(len(records)) if index not in errors]
+    validated = user_input_list_adapter.validate_python([records[index] for index in valid_indices])
+    return dict(zip(valid_indices, validated)), errors
+
+
+def predict_probabilities(rows, cache=True):
+    """
+    Scores feature rows, timing the feature build, every base estimator and the meta-model. The
+    preprocessed rows and their probabilities are recorded by the drift monitor and, with cache,
+    put in the prediction cache together.
+    """
+    with latency_metrics.time('feature_build'):
+        features = build_feature_matrix(rows)
+
+    if isinstance(model, CompiledStackingModel):
+        # the compiled model scores the trees of all base estimators in one traversal
+        with latency_metrics.time('base_estimator', estimator='compiled_trees'):
+            base_probabilities = model.base_predict_proba(features)
+        with latency_metrics.time('meta_model'):
+            probabilities = model.meta_predict_proba(base_probabilities)[:, 1]
+    else:
+        # the steps of StackingClassifier.predict_proba, one base estimator at a time
+        names = [name for name, estimator in model.estimators if estimator != 'drop']
+        predictions = []
+        for name, estimator, method in zip(names, model.estimators_, model.stack_method_):
+            with latency_metrics.time('base_estimator', estimator=name):
+                predictions.append(getattr(estimator, method)(features))
+        with latency_metrics.time('meta_model'):
+            probabilities = model.final_estimator_.predict_proba(model._concatenate_predictions(features, predictions))[:, 1]
+
+    features = np.asarray(features, dtype=np.float64)
+    if drift_monitor is not None:
+        drift_monitor.update(features, probabilities)
+    if cache:
+        # the preprocessed row is kept so that a cache hit is still counted by the drift monitor
+        for index, row in enumerate(rows):
+            prediction_cache.put(row, (float(probabilities[index]), features[index:index + 1].copy()))
+    return probabilities
+
+
+def record_cache_hits(entries):
+    """
+    Counts (probability, preprocessed row) entries answered from the prediction cache in the drift
+    monitor, as if they had been scored again.
+    """
+    if drift_monitor is not None and entries:
+        drift_monitor.update(np.concatenate([features for _, features in entries]), np.array([probability for probability, _ in entries]))
+
+
+def load_explainer():
+    """
+    The TreeSHAP explainer of the loaded model, built on the first call. None when REASON_CODES=0,
+    before the model is ready, or when the model cannot be explained.
+    """
+    global explainer, explainer_error
+    if explainer is not None or not REASON_CODES or not model_status['ready']:
+        return explainer
+    with explainer_lock:
+        if explainer is None and explainer_error is None:
+            # the joblib model is compiled in memory, the explainer reads the compiled node arrays
+            try:
+                compiled = model if isinstance(model, CompiledStackingModel) else compile_stacking_model(model)
+                explainer = TreeShapExplainer(compiled, max_table_bytes=int(REASON_CODES_TABLE_MB * 2**20))
+                model_status['reason_codes'] = True
+            except Exception as e:
+                # a model the explainer does not support (ValueError), or a MemoryError while
+                # building the tables; either way later requests get the 503 without retrying
+                explainer_error = f"{type(e).__name__}: {e}"
+                print(f"Warning: reason codes are not available: {explainer_error}")
+    return explainer
+
+
+def reason_codes(rows, top_k):
+    """
+    The top_k reason codes of every feature row (see TreeShapExplainer.reason_codes), contributions
+    rounded to 4 decimals.
+    """
+    with latency_metrics.time('explanation'):
+        features = build_feature_matrix(rows)
+        return [[{'feature': feature, 'contribution': round(contribution, 4)} for feature, contribution in reasons]
+                for reasons in explainer.reason_codes(features, top_k)]
+
+
+# Concurrent /predict calls are queued and scored together, see micro_batching.MicroBatcher
+micro_batcher = MicroBatcher(
+    predict_probabilities,
+    max_batch_size=int(os.getenv('MICRO_BATCH_MAX_SIZE', 64)),
+    max_wait_ms=float(os.getenv('MICRO_BATCH_MAX_WAIT_MS', 5))
+)
+
+if MODEL_LOADING == 'eager':
+    load_model()
+
+
 @app.get('/')
 def home():
     return {'message': 'Welcome to The Credit Risk Prediction API'}
@@ -28,27 +399,130 @@ def health_check():
         'version': "1.0.0"
     }
 
-@app.post('/predict')
-def predict_default_probability(data: UserInput):
-
-    input_df = pd.DataFrame([{
-        'RevolvingUtilizationOfUnsecuredLines': data.RevolvingUtilizationOfUnsecuredLines,
-        'age': data.age,
-        'NumberOfTime30_59DaysPastDueNotWorse': data.NumberOfTime30_59DaysPastDueNotWorse,
-        'DebtRatio': data.DebtRatio,
-        'MonthlyIncome': data.MonthlyIncome,
-        'NumberOfOpenCreditLinesAndLoans': data.NumberOfOpenCreditLinesAndLoans,
-        'NumberOfTimes90DaysLate': data.NumberOfTimes90DaysLate,
-        'NumberRealEstateLoansOrLines': data.NumberRealEstateLoansOrLines,
-        'NumberOfTime60_89DaysPastDueNotWorse': data.NumberOfTime60_89DaysPastDueNotWorse,
-        'NumberOfDependents': data.NumberOfDependents
-    }])
-    
+@app.get('/ready')
+def readiness_check():
+    if not model_status['ready']:
+        return JSONResponse(status_code=503, content={'status': 'error' if model_status['error'] else 'loading', **model_status})
+    return {'status': 'ready', **model_status}
+
+@app.get('/predict/batching-stats')
+def micro_batching_stats():
+    return micro_batcher.stats()
+
+@app.get('/predict/cache-stats')
+def prediction_cache_stats():
+    return prediction_cache.stats()
+
+@app.get('/monitoring/drift')
+def drift_report():
+    if drift_monitor is None:
+        return FastJSONResponse(status_code=503, content={'detail': "Drift monitoring is not available"})
+    return drift_monitor.report()
+
+@app.get('/monitoring/drift/snapshot')
+def drift_snapshot():
+    if drift_monitor is None:
+        return FastJSONResponse(status_code=503, content={'detail': "Drift monitoring is not available"})
+    return drift_monitor.snapshot()
+
+@app.get('/metrics')
+def prometheus_metrics():
+    return PlainTextResponse(latency_metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.get('/debug/profiling')
+def profiling_report(limit: int = 20, format: str = 'json'):
+    if format == 'collapsed':
+        return PlainTextResponse(profiler.collapsed())
+    return profiler.report(limit)
+
+@app.post('/debug/profiling')
+def switch_profiling(enabled: bool, interval_ms: float | None = Query(None, gt=0), reset: bool = True):
+    if enabled:
+        profiler.start(interval_ms=interval_ms, reset=reset)
+    else:
+        profiler.stop()
+    return {'running': profiler.running, 'interval_ms': profiler.interval_ms, 'samples': profiler.samples}
+
+# the body is validated inside the route, so that validation shows up in the stage timings; the
+# request schema is still published as UserInput
+@app.post('/predict', openapi_extra={'requestBody': {'content': {'application/json': {'schema': UserInput.model_json_schema()}}, 'required': True}})
+async def predict_default_probability(request: Request, reasons: int = Query(0, ge=0, le=len(MODEL_FEATURES))):
+
+    body = await request.body()
+    with latency_metrics.time('validation'):
+        data = parse_user_input(body, request.headers.get('content-type'))
+        row = feature_row(data)
+
+    if not model_status['ready']:
+        return FastJSONResponse(status_code=503, content={'detail': "Model is not loaded yet"})
+    # the first request for reasons builds the explainer, off the event loop
+    if reasons and explainer is None and await asyncio.get_running_loop().run_in_executor(None, load_explainer) is None:
+        return FastJSONResponse(status_code=503, content={'detail': "Reason codes are not available"})
+
     try:
-        probability_of_default = round(model.predict_proba(input_df)[:,1].item(), 2)
+        cached = prediction_cache.get(row)
+        if cached is None:
+            probability_of_default = float(await micro_batcher.submit(row))
+        else:
+            probability_of_default = cached[0]
+            record_cache_hits([cached])
+
+        probability_of_default = round(probability_of_default, 2)
+        content = {'Probability of Default ': probability_of_default}
 
-        return JSONResponse(status_code=200, content={'Probability of Default ': probability_of_default})
+        if reasons:
+            explained = await asyncio.get_running_loop().run_in_executor(None, reason_codes, [row], reasons)
+            content['reasons'] = explained[0]
+
+        return FastJSONResponse(status_code=200, content=content)
     
     except Exception as e:
 
-        return JSONResponse(status_code=500, content=str(e))
\ No newline at end of file
+        return FastJSONResponse(status_code=500, content=str(e))
+
+
+@app.post('/predict/batch')
+def predict_default_probability_batch(data: BatchUserInput, reasons: int = Query(0, ge=0, le=len(MODEL_FEATURES))):
+
+    if not model_status['ready']:
+        return FastJSONResponse(status_code=503, content={'detail': "Model is not loaded yet"})
+    if reasons and load_explainer() is None:
+        return FastJSONResponse(status_code=503, content={'detail': "Reason codes are not available"})
+
+    with latency_metrics.time('batch_validation'):
+        records = data.to_records()
+        validated, errors = validate_records(records)
+        rows = {index: feature_row(item) for index, item in validated.items()}
+
+    results = [None] * len(records)
+    for index, record_errors in errors.items():
+        results[index] = {'index': index, 'error': record_errors}
+
+    cached = {index: prediction_cache.get(row) for index, row in rows.items()}
+    record_cache_hits([entry for entry in cached.values() if entry is not None])
+    probabilities = {index: None if entry is None else entry[0] for index, entry in cached.items()}
+    missing = [index for index, probability_of_default in probabilities.items() if probability_of_default is None]
+
+    if missing:
+        try:
+            scored = predict_probabilities([rows[index] for index in missing])
+
+        except Exception as e:
+
+            return FastJSONResponse(status_code=500, content=str(e))
+
+        for index, probability_of_default in zip(missing, scored):
+            probabilities[index] = float(probability_of_default)
+
+    for index, probability_of_default in probabilities.items():
+        results[index] = {'index': index, 'Probability of Default ': round(probability_of_default, 2)}
+
+    if reasons and rows:
+        try:
+            explained = reason_codes(list(rows.values()), reasons)
+        except Exception as e:
+            return FastJSONResponse(status_code=500, content=str(e))
+        for index, row_reasons in zip(rows, explained):
+            results[index]['reasons'] = row_reasons
+
+    return FastJSONResponse(status_code=200, content={'predictions': results, 'failed': len(errors)})
@@ -0,0 +1,268 @@
+"""
+Tunes the three base estimators of the stacking model and writes best_rfc.pkl, best_xgbc.pkl and
+best_lgbmc.pkl, the files `training` loads.
+
+Each estimator is tuned with successive halving: a random sample of candidates is cross-validated
+on a small budget, the best 1/factor of them move on to a budget `factor` times larger, and so on
+until the full budget. The budget is the number of training rows for the RandomForest and the
+number of boosting rounds for XGBoost and LightGBM. All (candidate x fold) fits of a rung run on a
+process pool. Every finished fit is checkpointed in `.tuning_cache/`, so an interrupted search
+picks up where it stopped when it is started again with the same arguments.
+
+    python hyperparameter_tuning.py --estimators rfc xgb lgbm --max-hours 6
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from joblib import Parallel, delayed, cpu_count
+from lightgbm import LGBMClassifier
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import ParameterSampler, StratifiedKFold, train_test_split
+from xgboost import XGBClassifier
+
+from model_training_pipeline import estimator_cache_key
+
+TUNING_CACHE_DIR = '.tuning_cache'
+
+
+def search_spaces(cost_for_positive_class=13.96):
+    """
+    The estimators `training` stacks, keyed by their name in the stacking model: the output file,
+    the estimator with its fixed parameters, the parameter distributions to sample from, and the
+    budget (resource) parameter with its smallest and largest value. The resource 'n_samples'
+    means the number of training rows; None as the largest value means all of them.
+    """
+    return {
+        'rfc': {
+            'file': 'best_rfc.pkl',
+            'estimator': RandomForestClassifier(n_estimators=100, class_weight='balanced', random_state=42, n_jobs=-1),
+            'space': {
+                'max_depth': [5, 7, 9, 12, 16, None],
+                'min_samples_split': [2, 6, 10, 20],
+                'min_samples_leaf': [1, 2, 4, 8, 16],
+                'max_features': ['sqrt', 0.4, 0.6, 0.8],
+            },
+            'resource': ('n_samples', 10000, None),
+        },
+        'xgb': {
+            'file': 'best_xgbc.pkl',
+            'estimator': XGBClassifier(scale_pos_weight=cost_for_positive_class, random_state=42, n_jobs=-1),
+            'space': {
+                'learning_rate': [0.01, 0.02, 0.05, 0.1],
+                'max_depth': [3, 4, 5, 6, 8],
+                'min_child_weight': [1, 5, 10, 20],
+                'subsample': [0.6, 0.8, 1.0],
+                'colsample_bytree': [0.6, 0.8, 1.0],
+            },
+            'resource': ('n_estimators', 100, 1000),
+        },
+        'lgbm': {
+            'file': 'best_lgbmc.pkl',
+            'estimator': LGBMClassifier(scale_pos_weight=cost_for_positive_class, subsample_freq=1, random_state=42, n_jobs=-1, verbose=-1),
+            'space': {
+                'learning_rate': [0.01, 0.02, 0.05, 0.1],
+                'num_leaves': [8, 12, 16, 31, 63],
+                'min_child_samples': [10, 24, 50, 100],
+                'subsample': [0.6, 0.8, 1.0],
+                'colsample_bytree': [0.6, 0.8, 1.0],
+            },
+            'resource': ('n_estimators', 100, 1000),
+        },
+    }
+
+
+def halving_budgets(min_resource, max_resource, factor):
+    """
+    The budget of every rung, growing by `factor` and ending exactly at max_resource.
+    """
+    n_rungs = int(math.floor(math.log(max_resource / min_resource, factor) + 1e-9)) + 1
+    return [int(round(max_resource / factor ** (n_rungs - 1 - rung))) for rung in range(n_rungs)]
+
+
+def _write_json(path, content):
+    # written under a temporary name and renamed, so an interrupted search never leaves half a file
+    with open(path + '.tmp', 'w') as f:
+        json.dump(content, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _run_trial(estimator, X, y, train_index, test_index, n_threads, cache_path):
+    """
+    Fits one candidate on one fold with a bounded number of threads and checkpoints its held-out
+    ROC AUC in cache_path.
+    """
+    estimator = clone(estimator)
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=n_threads)
+
+    start = time.perf_counter()
+    estimator.fit(X.iloc[train_index], y[train_index])
+    score = roc_auc_score(y[test_index], estimator.predict_proba(X.iloc[test_index])[:, 1])
+    _write_json(cache_path, {'score': float(score), 'fit_seconds': time.perf_counter() - start})
+
+
+def successive_halving(estimator, space, resource, X, y, n_candidates=None, factor=3, cv=3, n_jobs=-1,
+                       random_state=42, deadline=None, cache_dir=TUNING_CACHE_DIR):
+    """
+    Runs successive halving for one estimator and returns (best_params, rungs). best_params include
+    the resource parameter at the budget of the last finished rung (the full budget unless the
+    deadline stopped the search), except for 'n_samples', which is not an estimator parameter. rungs lists the budget and the mean CV score of every candidate of each rung.
+
+    n_candidates defaults to factor ** (number of rungs), so `factor` candidates reach the last
+    rung. Past `deadline` (a time.time() value) no further rung is started, and the best candidate
+    of the last finished rung wins.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    X = pd.DataFrame(X)
+    y = np.asarray(y)
+    data_key = joblib.hash((X, y))
+
+    resource_name, min_resource, max_resource = resource
+    if resource_name == 'n_samples':
+        max_resource = max_resource or len(X)
+        min_resource = min(min_resource, max_resource)
+        # every rung trains on a prefix of the same shuffled rows, so bigger rungs extend smaller ones
+        row_order = np.random.RandomState(random_state).permutation(len(X))
+    budgets = halving_budgets(min_resource, max_resource, factor)
+
+    if n_candidates is None:
+        n_candidates = factor ** len(budgets)
+    candidates = list(ParameterSampler(space, n_candidates, random_state=random_state))
+    # duplicates from a small space would only cost time
+    candidates = list({joblib.hash(params): params for params in candidates}.values())
+
+    n_workers = cpu_count() if n_jobs == -1 else n_jobs
+    n_threads = max(1, cpu_count() // n_workers)
+
+    rungs = []
+    for budget in budgets:
+        if deadline is not None and rungs and time.time() > deadline:
+            print(f"Time budget reached, keeping the best of the {rungs[-1]['budget']} {resource_name} rung")
+            break
+
+        if resource_name == 'n_samples':
+            rows = row_order[:budget]
+        else:
+            rows = np.arange(len(X))
+        folds = [(rows[train], rows[test]) for train, test in StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state).split(rows, y[rows])]
+
+        tasks, trial_paths = [], []
+        for params in candidates:
+            trial = clone(estimator).set_params(**params)
+            if resource_name != 'n_samples':
+                trial.set_params(**{resource_name: budget})
+            estimator_key = estimator_cache_key(trial)
+
+            paths = []
+            for train_index, test_index in folds:
+                path = os.path.join(cache_dir, f"trial_{joblib.hash((estimator_key, data_key, train_index, test_index))}.json")
+                paths.append(path)
+                if not os.path.exists(path):
+                    tasks.append(delayed(_run_trial)(trial, X, y, train_index, test_index, n_threads, path))
+            trial_paths.append(paths)
+
+        start = time.perf_counter()
+        print(f"Rung {resource_name}={budget}: {len(candidates)} candidates x {cv} folds, "
+              f"{len(candidates) * cv - len(tasks)} taken from {cache_dir}")
+        Parallel(n_jobs=n_workers)(tasks)
+
+        scores = []
+        for paths in trial_paths:
+            scores.append(float(np.mean([_read_json(path)['score'] for path in paths])))
+        ranked = sorted(zip(scores, range(len(candidates))), key=lambda pair: -pair[0])
+        rungs.append({
+            'budget': budget,
+            'seconds': time.perf_counter() - start,
+            'candidates': [{'params': candidates[index], 'score': score} for score, index in ranked],
+        })
+        print(f"  best ROC AUC {ranked[0][0]:.5f} with {candidates[ranked[0][1]]} ({rungs[-1]['seconds']:.1f}s)")
+
+        n_keep = max(1, int(math.ceil(len(candidates) / factor)))
+        candidates = [candidates[index] for _, index in ranked[:n_keep]]
+
+    best_params = dict(rungs[-1]['candidates'][0]['params'])
+    if resource_name != 'n_samples':
+        # the winner is only validated at the budget it was scored on, not at max_resource
+        best_params[resource_name] = rungs[-1]['budget']
+        if rungs[-1]['budget'] < max_resource:
+            print(f"Keeping {resource_name}={rungs[-1]['budget']}: the winner was not scored at {resource_name}={max_resource}")
+    return best_params, rungs
+
+
+def tune_base_estimators(X_train, y_train, names=('rfc', 'xgb', 'lgbm'), cost_for_positive_class=13.96, factor=3, cv=3,
+                         n_candidates=None, n_jobs=-1, max_hours=None, output_dir='.', cache_dir=TUNING_CACHE_DIR):
+    """
+    Tunes the named base estimators one after another and writes each winner, unfitted and with
+    its best parameters, to the file `training` loads (see search_spaces). max_hours is shared by
+    all estimators. Also writes tuning_report.json with the scores of every rung.
+    """
+    deadline = None if max_hours is None else time.time() + max_hours * 3600
+    spaces = search_spaces(cost_for_positive_class)
+    report = {}
+
+    for position, name in enumerate(names):
+        spec = spaces[name]
+        print(f"Tuning {name} ({type(spec['estimator']).__name__})")
+        # an even share of the remaining time, so the last estimator is not starved
+        estimator_deadline = None if deadline is None else time.time() + (deadline - time.time()) / (len(names) - position)
+        best_params, rungs = successive_halving(
+            spec['estimator'], spec['space'], spec['resource'], X_train, y_train, n_candidates=n_candidates,
+            factor=factor, cv=cv, n_jobs=n_jobs, deadline=estimator_deadline, cache_dir=cache_dir
+        )
+
+        best_estimator = clone(spec['estimator']).set_params(**best_params)
+        joblib.dump(best_estimator, os.path.join(output_dir, spec['file']))
+        print(f"Saved {spec['file']}: {best_params}")
+
+        report[name] = {'file': spec['file'], 'best_params': best_params, 'best_score': rungs[-1]['candidates'][0]['score'], 'rungs': rungs}
+
+    _write_json(os.path.join(output_dir, 'tuning_report.json'), report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--train', default='GiveMeSomeCredit/cs-training.csv', help="GiveMeSomeCredit training csv")
+    parser.add_argument('--estimators', nargs='+', default=['rfc', 'xgb', 'lgbm'], choices=['rfc', 'xgb', 'lgbm'])
+    parser.add_argument('--imputation-strategy', default=os.getenv('IMPUTATION_STRATEGY', 'iterative_rf'))
+    parser.add_argument('--factor', type=int, default=3, help="budget growth and candidate reduction per rung")
+    parser.add_argument('--cv', type=int, default=3, help="cross-validation folds per candidate")
+    parser.add_argument('--candidates', type=int, default=None, help="candidates in the first rung (default: factor ** rungs)")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="parallel fits (default: all cores)")
+    parser.add_argument('--max-hours', type=float, default=None, help="stop starting new rungs after this long")
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--cache-dir', default=TUNING_CACHE_DIR)
+    args = parser.parse_args()
+
+    # the same rows main_file.py trains the stacking model on
+    from data_ingest import load_dataset
+    from data_preprocessing_pipeline import CreditDataPreprocessor
+
+    train_df = CreditDataPreprocessor(imputation_strategy=args.imputation_strategy).fit_transform(load_dataset(args.train))
+    X = train_df.drop('SeriousDlqin2yrs', axis=1)
+    y = train_df['SeriousDlqin2yrs']
+    X_train, _, y_train, _ = train_test_split(X, y, test_size=0.1, stratify=y, random_state=42)
+
+    tune_base_estimators(
+        X_train, y_train, names=args.estimators, factor=args.factor, cv=args.cv, n_candidates=args.candidates,
+        n_jobs=args.n_jobs, max_hours=args.max_hours, output_dir=args.output_dir, cache_dir=args.cache_dir
+    )
+
+
+if __name__ == '__main__':
+    main()
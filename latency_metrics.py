@@ -0,0 +1,170 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class LatencyMetrics:
+    """
+    Latency histograms of the prediction stages plus request counters, rendered in the Prometheus
+    text exposition format by render().
+
+    Every stage observation goes into fixed buckets (upper edges in seconds), so recording is O(1)
+    and memory does not grow with traffic. Percentiles are estimated from the buckets the same way
+    Prometheus' histogram_quantile() does, by linear interpolation inside the bucket.
+    """
+
+    buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    quantiles = (0.5, 0.95, 0.99)
+
+    def __init__(self, namespace='credit_risk'):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # label tuple -> [bucket counts (last one is +Inf), sum, count]
+            self._stages = {}
+            self._requests = {}
+            self._request_durations = {}
+
+    @staticmethod
+    def _observe(histograms, labels, seconds, n_buckets):
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = [[0] * (n_buckets + 1), 0.0, 0]
+        histogram[0][bisect_left(LatencyMetrics.buckets, seconds)] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+    def observe(self, stage, seconds, **labels):
+        key = (('stage', stage),) + tuple(sorted(labels.items()))
+        with self._lock:
+            self._observe(self._stages, key, seconds, len(self.buckets))
+
+    @contextmanager
+    def time(self, stage, **labels):
+        """
+        Context manager that records the duration of its block as one observation of `stage`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def count_request(self, endpoint, status_code, seconds):
+        with self._lock:
+            key = (('endpoint', endpoint), ('status', str(status_code)))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._observe(self._request_durations, (('endpoint', endpoint),), seconds, len(self.buckets))
+
+    @classmethod
+    def _quantile(cls, counts, total, q):
+        if total == 0:
+            return float('nan')
+        rank = q * total
+        cumulative = 0
+        for position, count in enumerate(counts):
+            if cumulative + count >= rank and count > 0:
+                if position == len(cls.buckets):
+                    # the +Inf bucket has no upper edge, like histogram_quantile() report the last finite one
+                    return cls.buckets[-1]
+                lower = cls.buckets[position - 1] if position > 0 else 0.0
+                return lower + (cls.buckets[position] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return cls.buckets[-1]
+
+    def quantile(self, stage, q, **labels):
+        key = (('stage', stage),) + tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._stages.get(key)
+            return self._quantile(histogram[0], histogram[2], q) if histogram else float('nan')
+
+    def _render_histogram(self, lines, name, help_text, histograms):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, (counts, total_seconds, count) in sorted(histograms.items()):
+            cumulative = 0
+            for edge, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", edge),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total_seconds)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+    def _render_quantiles(self, lines, name, help_text, histograms):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, (counts, _, count) in sorted(histograms.items()):
+            for q in self.quantiles:
+                lines.append(f'{name}{_format_labels(labels + (("quantile", q),))} {_format_value(self._quantile(counts, count, q))}')
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        prefix = self.namespace
+        lines = []
+        with self._lock:
+            self._render_histogram(lines, f'{prefix}_stage_duration_seconds', "Duration of one prediction stage.", self._stages)
+            self._render_quantiles(lines, f'{prefix}_stage_duration_quantile_seconds', "p50/p95/p99 of the stage durations, estimated from the histogram buckets.", self._stages)
+            self._render_histogram(lines, f'{prefix}_request_duration_seconds', "Duration of a request, including validation errors.", self._request_durations)
+            self._render_quantiles(lines, f'{prefix}_request_duration_quantile_seconds', "p50/p95/p99 of the request durations, estimated from the histogram buckets.", self._request_durations)
+
+            lines.append(f'# HELP {prefix}_requests_total Requests by endpoint and HTTP status.')
+            lines.append(f'# TYPE {prefix}_requests_total counter')
+            for labels, count in sorted(self._requests.items()):
+                lines.append(f'{prefix}_requests_total{_format_labels(labels)} {count}')
+
+            errors = {}
+            for labels, count in self._requests.items():
+                if int(labels[1][1]) >= 400:
+                    errors[labels[:1]] = errors.get(labels[:1], 0) + count
+            lines.append(f'# HELP {prefix}_request_errors_total Requests answered with a 4xx or 5xx status, by endpoint.')
+            lines.append(f'# TYPE {prefix}_request_errors_total counter')
+            for labels, count in sorted(errors.items()):
+                lines.append(f'{prefix}_request_errors_total{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class RequestMetricsMiddleware:
+    """
+    Plain ASGI middleware that counts the requests to `paths` by status code and records their
+    duration in a LatencyMetrics. Unlike an @app.middleware('http') function it does not wrap the
+    request and response objects, so it adds next to nothing to the request latency.
+    """
+
+    def __init__(self, app, metrics, paths):
+        self.app = app
+        self.metrics = metrics
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.count_request(scope['path'], status_code, time.perf_counter() - start)
@@ -1,20 +1,26 @@
 import joblib
-
-import pandas as pd
-import numpy as np
+import os
 
 from sklearn.model_selection import train_test_split
 
-from data_preprocessing_pipeline import wrangle
+from data_ingest import load_dataset
+from data_preprocessing_pipeline import CreditDataPreprocessor
 from model_training_pipeline import training
 from model_evaluation_pipeline import classification_evaluation
+from drift_monitor import build_reference, save_reference
 
-train_df = pd.read_csv("GiveMeSomeCredit/cs-training.csv").drop(columns=["Unnamed: 0"])
-test_df_index = pd.read_csv("GiveMeSomeCredit/cs-test.csv")
+# typed Parquet copies of the csv files, rebuilt when a csv changes (see data_ingest.py)
+train_df = load_dataset("GiveMeSomeCredit/cs-training.csv")
+test_df = load_dataset("GiveMeSomeCredit/cs-test.csv")
 
-test_df = test_df_index.drop(columns=["Unnamed: 0"])
+# one of data_preprocessing_pipeline.IMPUTATION_STRATEGIES
+preprocessor = CreditDataPreprocessor(imputation_strategy=os.getenv('IMPUTATION_STRATEGY', 'iterative_rf'))
+train_df = preprocessor.fit_transform(train_df)
+test_df = preprocessor.transform(test_df)
 
-train_df, test_df = wrangle(train_df, test_df)
+joblib.dump(preprocessor, "preprocessor.joblib")
+# the API never receives missing values, so it loads this small copy without the imputer
+joblib.dump(preprocessor.without_imputer(), "preprocessor_serving.joblib")
 
 X = train_df.drop('SeriousDlqin2yrs', axis=1)
 y = train_df['SeriousDlqin2yrs']
@@ -23,6 +29,11 @@ X_test = test_df.drop('SeriousDlqin2yrs', axis=1)
 
 X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.1, stratify=y, random_state=42)
 
-best_model = training(X_train, y_train)
+best_model = training(X_train, y_train, mode=os.getenv('TRAINING_MODE', 'sequential'))
+
+# training profile the API compares its traffic with (see drift_monitor.py); the probabilities are
+# those of the held-out rows, like the ones the API serves
+save_reference(build_reference(X_train, best_model.predict_proba(X_val)[:, 1]), "drift_reference.json")
 
-classification_evaluation(best_model, X_train, y_train, X_val, y_val)
\ No newline at end of file
+# set EVALUATION_OUTPUT_DIR to write figures and metrics there instead of showing them
+classification_evaluation(best_model, X_train, y_train, X_val, y_val, output_dir=os.getenv('EVALUATION_OUTPUT_DIR'))
\ No newline at end of file
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Collects single-record prediction requests on an asyncio queue and scores them together.
+
+    A batch is flushed to `predict_fn` as soon as it holds `max_batch_size` records or the oldest
+    record has waited `max_wait_ms` milliseconds, whichever comes first. `predict_fn` receives a
+    list of records and must return one probability per record, in the same order. It runs on the
+    default thread pool so the event loop keeps accepting requests while the model is busy.
+    """
+
+    # upper edges (in rows / milliseconds) of the histogram buckets reported by stats()
+    batch_size_buckets = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+    queue_wait_buckets_ms = (0.5, 1, 2, 5, 10, 25, 50, 100, 250)
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size should be at least 1")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms should not be negative")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = None
+        self._worker = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.batches = 0
+        self.records = 0
+        self.batch_size_counts = np.zeros(len(self.batch_size_buckets) + 1, dtype=np.int64)
+        self.queue_wait_counts = np.zeros(len(self.queue_wait_buckets_ms) + 1, dtype=np.int64)
+        self.queue_wait_total_ms = 0.0
+        self.queue_wait_max_ms = 0.0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, record):
+        """
+        Queues one record and waits for its probability.
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        max_wait = self.max_wait_ms / 1000
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = batch[0][2] + max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+
+            flushed_at = time.perf_counter()
+            self._record_batch(batch, flushed_at)
+
+            records = [record for record, _, _ in batch]
+            try:
+                probabilities = await loop.run_in_executor(None, self.predict_fn, records)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, _), probability in zip(batch, probabilities):
+                if not future.done():
+                    future.set_result(float(probability))
+
+    def _record_batch(self, batch, flushed_at):
+        waits_ms = np.array([(flushed_at - enqueued_at) * 1000 for _, _, enqueued_at in batch])
+
+        self.batches += 1
+        self.records += len(batch)
+        self.batch_size_counts[np.searchsorted(self.batch_size_buckets, len(batch))] += 1
+        np.add.at(self.queue_wait_counts, np.searchsorted(self.queue_wait_buckets_ms, waits_ms), 1)
+        # plain floats, so stats() stays serializable by any JSON encoder
+        self.queue_wait_total_ms += float(waits_ms.sum())
+        self.queue_wait_max_ms = max(self.queue_wait_max_ms, float(waits_ms.max()))
+
+    def stats(self):
+        """
+        Returns the batch-size and queue-wait histograms (cumulative per bucket upper edge, like
+        Prometheus) together with the current limits.
+        """
+        def histogram(edges, counts):
+            labels = [str(edge) for edge in edges] + ['+Inf']
+            return dict(zip(labels, np.cumsum(counts).tolist()))
+
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'batches': self.batches,
+            'records': self.records,
+            'mean_batch_size': self.records / self.batches if self.batches else 0.0,
+            'batch_size_histogram': histogram(self.batch_size_buckets, self.batch_size_counts),
+            'mean_queue_wait_ms': float(self.queue_wait_total_ms / self.records) if self.records else 0.0,
+            'max_queue_wait_ms': float(self.queue_wait_max_ms),
+            'queue_wait_ms_histogram': histogram(self.queue_wait_buckets_ms, self.queue_wait_counts),
+        }
@@ -1,5 +1,9 @@
+import json
+import os
+
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 from sklearn.metrics import (accuracy_score,
                              balanced_accuracy_score,
                              precision_score,
@@ -13,64 +17,161 @@ from sklearn.metrics import (accuracy_score,
                              ConfusionMatrixDisplay,)
 
 
-def classification_evaluation(model, X_train, y_train, X_test, y_test, threshold=0.5):
-    # ===== Train Predictions =====
-    prob_train = model.predict_proba(X_train)[:, 1]
-    y_pred_train = (prob_train >= threshold).astype(int)
+def _safe_divide(numerator, denominator):
+    # 0 where the denominator is 0, like zero_division=0 in sklearn.metrics
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=denominator != 0)
+
+
+def threshold_sweep(y_true, y_prob, thresholds=None):
+    """
+    Confusion matrix counts and metrics at every threshold (prob >= threshold is predicted positive)
+    from cumulative counts instead of one pass per threshold and metric. With thresholds=None every
+    distinct score is used as a threshold (one sort, O(n log n)); otherwise each score is binned
+    against the sorted thresholds (O(n log k)). Returns one row per threshold, in the given order.
+    """
+    y_true = np.asarray(y_true) == 1
+    y_prob = np.asarray(y_prob, dtype=np.float64)
+
+    if thresholds is None:
+        order = np.argsort(y_prob)
+        sorted_prob = y_prob[order]
+        thresholds = sorted_prob[np.concatenate([[True], sorted_prob[1:] != sorted_prob[:-1]])]
+        # positives among the k lowest scores, for k = 0..n
+        positives_below = np.concatenate([[0], np.cumsum(y_true[order])])
+        n_below = np.searchsorted(sorted_prob, thresholds, side='left')
+        predicted_positive = len(y_prob) - n_below
+        tp = positives_below[-1] - positives_below[n_below]
+    else:
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        threshold_order = np.argsort(thresholds)
+        # a score is predicted positive for every threshold at or below it
+        n_passed = np.searchsorted(thresholds[threshold_order], y_prob, side='right')
+        n_bins = len(thresholds) + 1
+        # scores (and positives) predicted positive at the j-th smallest threshold: n_passed > j
+        predicted_positive = np.cumsum(np.bincount(n_passed, minlength=n_bins)[::-1])[::-1][1:]
+        tp = np.cumsum(np.bincount(n_passed, weights=y_true, minlength=n_bins)[::-1])[::-1][1:].astype(np.int64)
+        inverse = np.empty_like(threshold_order)
+        inverse[threshold_order] = np.arange(len(thresholds))
+        predicted_positive, tp = predicted_positive[inverse], tp[inverse]
+
+    n_samples = len(y_true)
+    n_positive = int(y_true.sum())
+    fp = predicted_positive - tp
+    fn = n_positive - tp
+    tn = (n_samples - n_positive) - fp
+
+    precision = _safe_divide(tp, tp + fp)
+    recall = _safe_divide(tp, tp + fn)
+    specificity = _safe_divide(tn, tn + fp)
+
+    return pd.DataFrame({
+        'threshold': thresholds,
+        'tp': tp,
+        'fp': fp,
+        'tn': tn,
+        'fn': fn,
+        'accuracy': (tp + tn) / n_samples,
+        'balanced_accuracy': (recall + specificity) / 2,
+        'precision': precision,
+        'recall': recall,
+        'specificity': specificity,
+        'f1': _safe_divide(2 * tp, 2 * tp + fp + fn),
+    })
+
+
+def _print_metrics(title, y_true, y_pred, prob, threshold):
+    """
+    Prints the headline metrics at a threshold and returns them as a dict.
+    """
+    metrics = {
+        'threshold': threshold,
+        'accuracy': accuracy_score(y_true, y_pred),
+        'balanced_accuracy': balanced_accuracy_score(y_true, y_pred),
+        'precision': precision_score(y_true, y_pred),
+        'recall': recall_score(y_true, y_pred),
+        'f1': f1_score(y_true, y_pred),
+        'auc_roc': roc_auc_score(y_true, prob),
+    }
+    print(f"\n------ {title} Evaluation at threshold={threshold} ------")
+    print(f"Accuracy:  {metrics['accuracy']:.4f}")
+    print(f"Balanced Accuracy: {metrics['balanced_accuracy']:.4f}")
+    print(f"Precision: {metrics['precision']:.4f}")
+    print(f"Recall:    {metrics['recall']:.4f}")
+    print(f"F1-Score:  {metrics['f1']:.4f}")
+    print(f"AUC-ROC:   {metrics['auc_roc']:.4f}")
+    return metrics
+
+
+def _report(name, y_true, y_pred, metrics):
+    print(f"\nClassification Report ({name}):")
+    print(classification_report(y_true, y_pred, digits=4))
+
+    cm = confusion_matrix(y_true, y_pred)
+    print(f"Confusion Matrix ({name}):\n", cm)
+
+    metrics['confusion_matrix'] = cm.tolist()
+    metrics['classification_report'] = classification_report(y_true, y_pred, digits=4, output_dict=True)
+    return cm
+
+
+def _show_or_save(output_dir, file_name):
+    if output_dir is None:
+        plt.show()
+    else:
+        plt.savefig(os.path.join(output_dir, file_name), bbox_inches='tight')
+        plt.close()
+
+
+def classification_evaluation(model, X_train, y_train, X_test, y_test, threshold=0.5,
+                              prob_train=None, prob_test=None, evaluate_train=True, output_dir=None):
+    """
+    Prints and plots the evaluation of a binary classifier on the train and test sets and returns
+    the metrics as a dict.
+
+    Precomputed positive-class probabilities can be passed as prob_train / prob_test to skip the
+    predict_proba calls; evaluate_train=False skips the train set entirely. With an output_dir the
+    evaluation is headless: figures are saved as PNG files (non-GUI Agg backend) instead of shown,
+    and the metrics are written to metrics.json and the threshold sweep to threshold_sweep.parquet.
+    """
+    if output_dir is not None:
+        plt.switch_backend('Agg')
+        os.makedirs(output_dir, exist_ok=True)
+
+    results = {}
+
+    if evaluate_train:
+        # ===== Train Predictions =====
+        if prob_train is None:
+            prob_train = model.predict_proba(X_train)[:, 1]
+        y_pred_train = (prob_train >= threshold).astype(int)
+
+        # ===== TRAIN METRICS =====
+        results['train'] = _print_metrics("Training", y_train, y_pred_train, prob_train, threshold)
+        cm_train = _report("Train", y_train, y_pred_train, results['train'])
+
+        disp_train = ConfusionMatrixDisplay(confusion_matrix=cm_train)
+        disp_train.plot(cmap="Blues", colorbar=False)
+        plt.title("Confusion Matrix - Train")
+        _show_or_save(output_dir, "confusion_matrix_train.png")
 
     # ===== Test Predictions =====
-    prob_test = model.predict_proba(X_test)[:, 1]
+    if prob_test is None:
+        prob_test = model.predict_proba(X_test)[:, 1]
     y_pred_test = (prob_test >= threshold).astype(int)
 
-    # ===== TRAIN METRICS =====
-    print(f"\n------ Training Evaluation at threshold={threshold} ------")
-    print(f"Accuracy:  {accuracy_score(y_train, y_pred_train):.4f}")
-    print(f"Balanced Accuracy: {balanced_accuracy_score(y_train, y_pred_train):.4f}")
-    print(f"Precision: {precision_score(y_train, y_pred_train):.4f}")
-    print(f"Recall:    {recall_score(y_train, y_pred_train):.4f}")
-    print(f"F1-Score:  {f1_score(y_train, y_pred_train):.4f}")
-    print(f"AUC-ROC:   {roc_auc_score(y_train, prob_train):.4f}")
-
-    print("\nClassification Report (Train):")
-    print(classification_report(y_train, y_pred_train, digits=4))
-
-    cm_train = confusion_matrix(y_train, y_pred_train)
-    print("Confusion Matrix (Train):\n", cm_train)
-
-    disp_train = ConfusionMatrixDisplay(confusion_matrix=cm_train)
-    disp_train.plot(cmap="Blues", colorbar=False)
-    plt.title("Confusion Matrix - Train")
-    plt.show()
-
     # ===== TEST METRICS =====
-    print(f"\n------ Testing Evaluation at threshold={threshold} ------")
-    print(f"Accuracy:  {accuracy_score(y_test, y_pred_test):.4f}")
-    print(f"Balanced Accuracy: {balanced_accuracy_score(y_test, y_pred_test):.4f}")
-    print(f"Precision: {precision_score(y_test, y_pred_test):.4f}")
-    print(f"Recall:    {recall_score(y_test, y_pred_test):.4f}")
-    print(f"F1-Score:  {f1_score(y_test, y_pred_test):.4f}")
-    print(f"AUC-ROC:   {roc_auc_score(y_test, prob_test):.4f}")
+    results['test'] = _print_metrics("Testing", y_test, y_pred_test, prob_test, threshold)
 
     # ===== Plot all the four Metrices ina single graph =====
     thresholds = np.arange(0, 1.01, 0.01)
 
-    accuracy_scores = []
-    precision_scores = []
-    recall_scores = []
-    f1_scores = []
-
-    for t in thresholds:
-        y_pred = (prob_test >= t).astype(int)
-        accuracy_scores.append(accuracy_score(y_test, y_pred))
-        precision_scores.append(precision_score(y_test, y_pred, zero_division=0))
-        recall_scores.append(recall_score(y_test, y_pred, zero_division=0))
-        f1_scores.append(f1_score(y_test, y_pred, zero_division=0))
+    sweep = threshold_sweep(y_test, prob_test, thresholds)
 
     plt.figure(figsize=(10, 7))
-    plt.plot(thresholds, accuracy_scores, label='Accuracy', color='purple', linestyle='-')
-    plt.plot(thresholds, precision_scores, label='Precision', color='blue', linestyle='--')
-    plt.plot(thresholds, recall_scores, label='Recall', color='green', linestyle='-.')
-    plt.plot(thresholds, f1_scores, label='F1-Score', color='red', linestyle=':')
+    plt.plot(thresholds, sweep['accuracy'], label='Accuracy', color='purple', linestyle='-')
+    plt.plot(thresholds, sweep['precision'], label='Precision', color='blue', linestyle='--')
+    plt.plot(thresholds, sweep['recall'], label='Recall', color='green', linestyle='-.')
+    plt.plot(thresholds, sweep['f1'], label='F1-Score', color='red', linestyle=':')
 
     plt.title('Performance Metrics vs. Threshold')
     plt.xlabel('Threshold')
@@ -78,18 +179,14 @@ def classification_evaluation(model, X_train, y_train, X_test, y_test, threshold
     plt.ylim(0, 1.05)
     plt.grid(True)
     plt.legend()
-    plt.show()
+    _show_or_save(output_dir, "metrics_vs_threshold.png")
 
-    print("\nClassification Report (Test):")
-    print(classification_report(y_test, y_pred_test, digits=4))
-
-    cm_test = confusion_matrix(y_test, y_pred_test)
-    print("Confusion Matrix (Test):\n", cm_test)
+    cm_test = _report("Test", y_test, y_pred_test, results['test'])
 
     disp_test = ConfusionMatrixDisplay(confusion_matrix=cm_test)
     disp_test.plot(cmap="Oranges", colorbar=False)
     plt.title("Confusion Matrix - Test")
-    plt.show()
+    _show_or_save(output_dir, "confusion_matrix_test.png")
 
     # ===== Test ROC Curve =====
     fpr, tpr, thresholds = roc_curve(y_test, prob_test)
@@ -103,5 +200,11 @@ def classification_evaluation(model, X_train, y_train, X_test, y_test, threshold
     plt.title('Receiver Operating Characteristic (ROC) Curve')
     plt.legend(loc='lower right')
     plt.grid(True)
-    plt.show()
+    _show_or_save(output_dir, "roc_curve_test.png")
+
+    if output_dir is not None:
+        with open(os.path.join(output_dir, "metrics.json"), "w") as metrics_file:
+            json.dump(results, metrics_file, indent=2, default=float)
+        sweep.to_parquet(os.path.join(output_dir, "threshold_sweep.parquet"), index=False)
 
+    return results
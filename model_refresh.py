@@ -0,0 +1,116 @@
+"""
+Refreshes the saved stacking model with a batch of newly labeled rows instead of retraining it
+(see model_training_pipeline.refresh_stacking_model), then saves it and its compiled copy.
+
+The refreshed model is written to a new, timestamped file by default, next to the model the API
+serves rather than over it. Once the report looks right, promote it by copying the .pkl over
+stacking_model.pkl and re-saving the compiled copy, which swaps it in atomically (see
+CompiledStackingModel.save):
+
+    python -c "from tree_compiler import CompiledStackingModel as M; M.load('<output>_compiled', mmap=False).save('stacking_model_compiled')"
+
+--output stacking_model.pkl writes over the served model directly.
+
+Part of the batch is held out. The previous model, the refreshed model and, with --history, a
+full retrain on the history plus the batch are all scored on it, and the ROC AUCs are printed and
+written to the report.
+
+    python model_refresh.py new_labels.csv --history GiveMeSomeCredit/cs-training.csv
+"""
+import argparse
+import json
+import os
+import time
+
+import joblib
+import pandas as pd
+
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from data_ingest import load_dataset
+from data_preprocessing_pipeline import TARGET_COLUMN
+from model_training_pipeline import refresh_stacking_model, training
+from tree_compiler import compile_stacking_model
+
+
+def read_labeled(path, preprocessor):
+    """
+    Reads a GiveMeSomeCredit-shaped csv or Parquet file and applies the fitted preprocessor; the
+    imputer is not refit. Returns (X, y).
+    """
+    dataframe = pd.read_parquet(path) if path.endswith('.parquet') else load_dataset(path)
+    dataframe = preprocessor.transform(dataframe)
+    return dataframe.drop(TARGET_COLUMN, axis=1), dataframe[TARGET_COLUMN].astype(int)
+
+
+def holdout_auc(model, X, y):
+    return float(roc_auc_score(y, model.predict_proba(X)[:, 1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('new_data', help="csv or .parquet file of newly labeled rows with the raw GiveMeSomeCredit columns")
+    parser.add_argument('--model', default='stacking_model.pkl', help="fitted stacking model to refresh")
+    parser.add_argument('--preprocessor', default='preprocessor.joblib')
+    parser.add_argument('--output', default=None,
+                        help="where to save the refreshed model, by default stacking_model_refresh_<timestamp>.pkl; the compiled copy goes "
+                             "next to it as <output>_compiled. --output stacking_model.pkl replaces the served model")
+    parser.add_argument('--boosting-rounds', type=int, default=100, help="rounds added to XGBoost and LightGBM")
+    parser.add_argument('--rf-new-trees', type=int, default=20, help="trees added to the RandomForest")
+    parser.add_argument('--rf-max-trees', type=int, default=None, help="drop the oldest RandomForest trees beyond this many")
+    parser.add_argument('--holdout', type=float, default=0.2, help="share of the new rows held out for the AUC comparison")
+    parser.add_argument('--history', default=None, help="training csv; when given, a full retrain on it plus the new rows is compared too")
+    parser.add_argument('--training-mode', default=os.getenv('TRAINING_MODE', 'sequential'), help="mode of the full retrain")
+    parser.add_argument('--report', default='refresh_report.json')
+    args = parser.parse_args()
+    output = args.output or time.strftime('stacking_model_refresh_%Y%m%d_%H%M%S.pkl')
+    compiled_output = os.path.splitext(output)[0] + "_compiled"
+
+    preprocessor = joblib.load(args.preprocessor)
+    model = joblib.load(args.model)
+
+    X_new, y_new = read_labeled(args.new_data, preprocessor)
+    X_refresh, X_holdout, y_refresh, y_holdout = train_test_split(X_new, y_new, test_size=args.holdout, stratify=y_new, random_state=42)
+
+    start = time.perf_counter()
+    refreshed = refresh_stacking_model(model, X_refresh, y_refresh, boosting_rounds=args.boosting_rounds,
+                                       rf_new_trees=args.rf_new_trees, rf_max_trees=args.rf_max_trees)
+    refresh_seconds = time.perf_counter() - start
+    print(f"Refreshed {args.model} with {len(X_refresh)} rows in {refresh_seconds:.1f}s")
+
+    joblib.dump(refreshed, output)
+    try:
+        compile_stacking_model(refreshed).save(compiled_output)
+    except ValueError as e:
+        print(f"Skipping compiled model export: {e}")
+    print(f"Saved {output} and {compiled_output}")
+
+    report = {
+        'new_rows': len(X_refresh),
+        'holdout_rows': len(X_holdout),
+        'refresh_seconds': refresh_seconds,
+        'previous_auc': holdout_auc(model, X_holdout, y_holdout),
+        'refreshed_auc': holdout_auc(refreshed, X_holdout, y_holdout),
+    }
+
+    if args.history:
+        X_history, y_history = read_labeled(args.history, preprocessor)
+        start = time.perf_counter()
+        retrained = training(pd.concat([X_history, X_refresh]), pd.concat([y_history, y_refresh]), mode=args.training_mode, save=False)
+        report['full_retrain_seconds'] = time.perf_counter() - start
+        report['full_retrain_auc'] = holdout_auc(retrained, X_holdout, y_holdout)
+        report['auc_vs_full_retrain'] = report['refreshed_auc'] - report['full_retrain_auc']
+
+    print(f"Holdout ROC AUC: previous {report['previous_auc']:.4f}, refreshed {report['refreshed_auc']:.4f}"
+          + (f", full retrain {report['full_retrain_auc']:.4f} ({report['full_retrain_seconds']:.1f}s)" if args.history else ""))
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.output is None:
+        print(f"To serve it, copy {output} to stacking_model.pkl and re-save {compiled_output} as stacking_model_compiled "
+              f"(see the module docstring)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,178 @@
+import copy
 import joblib
+import os
 
 import pandas as pd
 import numpy as np
 
+from joblib import Parallel, delayed, cpu_count
+from sklearn.base import clone
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier, StackingClassifier
+from sklearn.preprocessing import LabelEncoder
+from sklearn.utils import Bunch
 from xgboost import XGBClassifier
 from lightgbm import LGBMClassifier
 
 from sklearn.model_selection import StratifiedKFold
 
+from tree_compiler import compile_stacking_model
+
+
+
+def estimator_cache_key(estimator):
+    # n_jobs only changes how fast an estimator fits, not what it learns
+    params = {key: value for key, value in estimator.get_params(deep=False).items() if key != 'n_jobs'}
+    return joblib.hash((type(estimator).__name__, params))
+
+
+def _fit_base_estimator(estimator, X, y, train_index, test_index, n_threads, cache_path):
+    """
+    Fits one base estimator on one fold (or on all rows when test_index is None) with a bounded
+    number of threads and stores the result in the cache: the held-out positive-class probabilities
+    for a fold, the fitted estimator for the full fit.
+    """
+    estimator = clone(estimator)
+    has_n_jobs = 'n_jobs' in estimator.get_params()
+    if has_n_jobs:
+        n_jobs = estimator.get_params()['n_jobs']
+        estimator.set_params(n_jobs=n_threads)
+
+    if test_index is None:
+        estimator.fit(X, y)
+        if has_n_jobs:
+            estimator.set_params(n_jobs=n_jobs)
+        joblib.dump(estimator, cache_path)
+    else:
+        estimator.fit(X.iloc[train_index], y[train_index])
+        np.save(cache_path, estimator.predict_proba(X.iloc[test_index])[:, 1])
+
+
+def fit_stacking_parallel(estimators, final_estimator, cv, X_train, y_train, n_jobs=-1, cache_dir=".stacking_cache"):
+    """
+    Fits the same model as StackingClassifier(estimators, final_estimator, cv).fit(X_train, y_train),
+    but schedules every (base estimator x fold) fit and every full refit on a process pool, each
+    with cpu_count / n_workers threads.
+
+    The out-of-fold predictions and the refitted base estimators are cached in `cache_dir`, keyed by
+    a hash of the data, the fold and the estimator parameters, so changing only the final estimator
+    does not retrain any base estimator. Only binary targets are supported.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    label_encoder = LabelEncoder().fit(y_train)
+    if len(label_encoder.classes_) != 2:
+        raise ValueError("fit_stacking_parallel only supports binary targets")
+    y_encoded = label_encoder.transform(y_train)
+
+    X_train = pd.DataFrame(X_train)
+    data_key = joblib.hash((X_train, y_encoded))
+    folds = list(cv.split(X_train, y_encoded))
+
+    n_workers = cpu_count() if n_jobs == -1 else n_jobs
+    n_threads = max(1, cpu_count() // n_workers)
+
+    tasks, fold_paths, full_paths = [], {}, {}
+    for name, estimator in estimators:
+        estimator_key = estimator_cache_key(estimator)
+
+        full_paths[name] = os.path.join(cache_dir, f"full_{joblib.hash((estimator_key, data_key))}.joblib")
+        if not os.path.exists(full_paths[name]):
+            tasks.append(delayed(_fit_base_estimator)(estimator, X_train, y_encoded, None, None, n_threads, full_paths[name]))
+
+        fold_paths[name] = []
+        for train_index, test_index in folds:
+            path = os.path.join(cache_dir, f"oof_{joblib.hash((estimator_key, data_key, test_index))}.npy")
+            fold_paths[name].append(path)
+            if not os.path.exists(path):
+                tasks.append(delayed(_fit_base_estimator)(estimator, X_train, y_encoded, train_index, test_index, n_threads, path))
+
+    print(f"Fitting {len(tasks)} base estimator tasks on {n_workers} workers ({n_threads} threads each), "
+          f"{len(estimators) * (len(folds) + 1) - len(tasks)} taken from {cache_dir}")
+    Parallel(n_jobs=n_workers)(tasks)
+
+    X_meta = np.zeros((len(X_train), len(estimators)))
+    for column, (name, _) in enumerate(estimators):
+        for (_, test_index), path in zip(folds, fold_paths[name]):
+            X_meta[test_index, column] = np.load(path)
+
+    fitted_estimators = [(name, joblib.load(full_paths[name])) for name, _ in estimators]
+
+    # cv="prefit" lets StackingClassifier wire up the fitted base estimators; its meta-model is then
+    # replaced by one trained on the out-of-fold predictions, as a regular fit would do
+    stacking_model = StackingClassifier(estimators=fitted_estimators, final_estimator=final_estimator, cv="prefit", passthrough=False, n_jobs=1)
+    stacking_model.fit(X_train, y_train)
+    stacking_model.final_estimator_ = clone(final_estimator).fit(X_meta, y_encoded)
+    stacking_model.cv = cv
 
+    return stacking_model
 
-def training(X_train, y_train):
 
-    cost_for_positive_class = 13.96
+def update_base_estimator(estimator, X, y, boosting_rounds=100, rf_new_trees=20, rf_max_trees=None):
+    """
+    Returns a copy of a fitted base estimator updated with (X, y) instead of refitted: XGBoost and
+    LightGBM continue boosting from their current trees for `boosting_rounds` rounds, and a
+    RandomForest keeps its trees and grows `rf_new_trees` more on (X, y), dropping the oldest ones
+    beyond rf_max_trees. n_estimators of the copy is the total number of trees or rounds.
+    """
+    if isinstance(estimator, XGBClassifier):
+        total = estimator.get_booster().num_boosted_rounds() + boosting_rounds
+        updated = clone(estimator).set_params(n_estimators=boosting_rounds)
+        updated.fit(X, y, xgb_model=estimator.get_booster())
+    elif isinstance(estimator, LGBMClassifier):
+        total = estimator.booster_.current_iteration() + boosting_rounds
+        updated = clone(estimator).set_params(n_estimators=boosting_rounds)
+        updated.fit(X, y, init_model=estimator.booster_)
+    elif isinstance(estimator, RandomForestClassifier):
+        updated = copy.deepcopy(estimator)
+        updated.set_params(warm_start=True, n_estimators=len(estimator.estimators_) + rf_new_trees)
+        updated.fit(X, y)
+        if rf_max_trees is not None and len(updated.estimators_) > rf_max_trees:
+            del updated.estimators_[:len(updated.estimators_) - rf_max_trees]
+        total = len(updated.estimators_)
+        updated.set_params(warm_start=False)
+    else:
+        raise ValueError(f"Cannot update a {type(estimator).__name__} incrementally")
+
+    # so that a clone of the updated estimator fits a model of the same size
+    updated.set_params(n_estimators=total)
+    return updated
+
+
+def refresh_stacking_model(stacking_model, X_new, y_new, boosting_rounds=100, rf_new_trees=20, rf_max_trees=None, cv=None):
+    """
+    Updates a fitted binary stacking model with a batch of newly labeled rows without retraining
+    it. Every base estimator is updated on the batch (see update_base_estimator), and the
+    LogisticRegression meta-model is refit on out-of-fold predictions for the batch: for each fold
+    of `cv` the base estimators are updated on the other folds and predict the held-out one.
+    Returns a new StackingClassifier; stacking_model is left unchanged.
+    """
+    cv = cv or StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+    X_new = pd.DataFrame(X_new)
+    y_encoded = LabelEncoder().fit(stacking_model.classes_).transform(y_new)
+    update_params = {'boosting_rounds': boosting_rounds, 'rf_new_trees': rf_new_trees, 'rf_max_trees': rf_max_trees}
+
+    X_meta = np.zeros((len(X_new), len(stacking_model.estimators_)))
+    for train_index, test_index in cv.split(X_new, y_encoded):
+        for column, estimator in enumerate(stacking_model.estimators_):
+            updated = update_base_estimator(estimator, X_new.iloc[train_index], y_encoded[train_index], **update_params)
+            X_meta[test_index, column] = updated.predict_proba(X_new.iloc[test_index])[:, 1]
+
+    updated_estimators = [update_base_estimator(estimator, X_new, y_encoded, **update_params) for estimator in stacking_model.estimators_]
+
+    refreshed = copy.copy(stacking_model)
+    refreshed.estimators_ = updated_estimators
+    refreshed.named_estimators_ = Bunch(**{name: estimator for (name, _), estimator in zip(stacking_model.estimators, updated_estimators)})
+    refreshed.final_estimator_ = clone(stacking_model.final_estimator_).fit(X_meta, y_encoded)
+    return refreshed
+
+
+def training(X_train, y_train, cost_for_positive_class=13.96, mode="sequential", n_jobs=-1, cache_dir=".stacking_cache", save=True):
+    """
+    Fits and saves the stacking model. mode="parallel" uses fit_stacking_parallel, which fits the
+    base estimators on a process pool and caches them in cache_dir. save=False only returns the
+    model, without writing stacking_model.pkl or the compiled model.
+    """
 
     best_rfc = joblib.load("best_rfc.pkl")
     best_xgbc = joblib.load("best_xgbc.pkl")
@@ -30,19 +188,29 @@ def training(X_train, y_train):
 
     cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
 
-    stacking_model = StackingClassifier(
-        estimators=estimators,
-        final_estimator=final_estimator,
-        cv=cv,
-        passthrough=False,
-        n_jobs=1
-    )
+    if mode == "parallel":
+        stacking_model = fit_stacking_parallel(estimators, final_estimator, cv, X_train, y_train, n_jobs=n_jobs, cache_dir=cache_dir)
+    elif mode == "sequential":
+        stacking_model = StackingClassifier(
+            estimators=estimators,
+            final_estimator=final_estimator,
+            cv=cv,
+            passthrough=False,
+            n_jobs=1
+        )
 
-    stacking_model.fit(X_train, y_train)
+        stacking_model.fit(X_train, y_train)
+    else:
+        raise ValueError(f"Unknown training mode '{mode}', expected 'sequential' or 'parallel'")
 
-    joblib.dump(stacking_model, "stacking_model.pkl")
+    if not save:
+        return stacking_model
 
-    return stacking_model
+    joblib.dump(stacking_model, "stacking_model.pkl")
 
-    
+    try:
+        compile_stacking_model(stacking_model).save("stacking_model_compiled")
+    except ValueError as e:
+        print(f"Skipping compiled model export: {e}")
 
+    return stacking_model
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    In-process LRU cache of predicted probabilities with a size bound and a per-entry TTL. The
+    values are whatever the caller puts, the API stores (probability, preprocessed row).
+
+    Keys are the model feature rows (tuples of floats in MODEL_FEATURES order), so two inputs that
+    lead to the same derived features share an entry. The cache is bound to a model version and
+    is cleared whenever a different version is bound. maxsize=0 disables caching.
+    """
+
+    def __init__(self, maxsize=10_000, ttl_seconds=300.0):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.model_version = None
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(feature_row):
+        # + 0.0 folds -0.0 into 0.0 so equal rows always hash the same
+        return tuple(float(value) + 0.0 for value in feature_row)
+
+    def bind(self, model_version):
+        """
+        Binds the cache to the loaded model artifact; entries of any other version are dropped.
+        """
+        with self._lock:
+            if model_version != self.model_version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self.model_version = model_version
+
+    def get(self, key):
+        if self.maxsize <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl_seconds,
+                'size': len(self._entries),
+                'model_version': self.model_version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
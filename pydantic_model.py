@@ -1,5 +1,20 @@
-from pydantic import BaseModel, Field, computed_field
-from typing import Literal, Annotated
+from pydantic import BaseModel, Field, computed_field, model_validator
+from typing import Literal, Annotated, Any, Optional
+
+
+# Column order the stacking model was trained on (see data_preprocessing_pipeline.wrangle)
+MODEL_FEATURES = [
+    'RevolvingUtilizationOfUnsecuredLines',
+    'age',
+    'NumberOfTime30_59DaysPastDueNotWorse',
+    'DebtRatio',
+    'MonthlyIncome',
+    'NumberOfOpenCreditLinesAndLoans',
+    'NumberOfTimes90DaysLate',
+    'NumberRealEstateLoansOrLines',
+    'NumberOfTime60_89DaysPastDueNotWorse',
+    'NumberOfDependents'
+]
 
 
 class UserInput(BaseModel):
@@ -32,3 +47,27 @@ class UserInput(BaseModel):
             return self.total_monthly_debt_payment / self.MonthlyIncome
 
 
+class BatchUserInput(BaseModel):
+    """
+    Payload for /predict/batch. Records are sent either row-wise as a list of UserInput
+    objects or column-wise as a mapping of field name -> list of values. Records are kept
+    as raw values here, not even checked to be objects, so that one invalid record does not
+    reject the whole batch.
+    """
+
+    records: Optional[list[Any]] = Field(None, title="Row-wise records", description="List of UserInput objects")
+    columns: Optional[dict[str, list[Any]]] = Field(None, title="Column-wise records", description="Mapping of UserInput field name to a list of values, one per record")
+
+    @model_validator(mode='after')
+    def check_single_layout(self):
+        if (self.records is None) == (self.columns is None):
+            raise ValueError("Provide exactly one of 'records' or 'columns'")
+        if self.columns is not None and len({len(values) for values in self.columns.values()}) > 1:
+            raise ValueError("All lists in 'columns' must have the same length")
+        return self
+
+    def to_records(self) -> list[Any]:
+        if self.records is not None:
+            return self.records
+        names = list(self.columns)
+        return [dict(zip(names, values)) for values in zip(*self.columns.values())]
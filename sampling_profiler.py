@@ -0,0 +1,123 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# samples of new stacks once max_stacks distinct stacks are held are counted under this one
+OTHER_STACKS = '[other stacks]'
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that can be switched on and off in a running process.
+
+    While running, a daemon thread wakes up every `interval_ms` milliseconds and records the Python
+    stack of every other thread (sys._current_frames()). Nothing is hooked into the profiled code,
+    so the cost is one stack walk per thread per interval and zero while stopped. The aggregated
+    stacks come out as a top list (report()) or in the collapsed format read by flamegraph.pl and
+    speedscope (collapsed()). At most max_stacks distinct stacks are kept.
+    """
+
+    def __init__(self, interval_ms=5.0, max_depth=64, max_stacks=10_000):
+        self.interval_ms = self._check_interval(interval_ms)
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @staticmethod
+    def _check_interval(interval_ms):
+        # without a positive wait the sampler thread would spin and hold the GIL
+        if not interval_ms > 0:
+            raise ValueError(f"interval_ms must be positive, got {interval_ms}")
+        return float(interval_ms)
+
+    def start(self, interval_ms=None, reset=True):
+        if interval_ms is not None:
+            self.interval_ms = self._check_interval(interval_ms)
+        if self.running:
+            return
+        with self._lock:
+            if reset:
+                self.stacks.clear()
+                self.samples = 0
+            self.started_at = time.time()
+            self.stopped_at = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self.stopped_at = time.time()
+
+    def _frame_label(self, frame):
+        code = frame.f_code
+        return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+    def _run(self):
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval_ms / 1000):
+            sampled = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None and len(labels) < self.max_depth:
+                    labels.append(self._frame_label(frame))
+                    frame = frame.f_back
+                sampled.append(';'.join(reversed(labels)))
+            with self._lock:
+                for stack in sampled:
+                    if stack in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[stack] += 1
+                    else:
+                        self.stacks[OTHER_STACKS] += 1
+                self.samples += 1
+
+    def _busy_stacks(self):
+        # threads parked in the event loop selector or waiting on a lock or queue are not doing work
+        idle = ('selectors.py:select', 'threading.py:wait', 'threading.py:_wait_for_tstate_lock', 'queue.py:get', 'thread.py:_worker')
+        with self._lock:
+            return Counter({stack: count for stack, count in self.stacks.items() if stack.rsplit(';', 1)[-1] not in idle})
+
+    def collapsed(self):
+        """
+        The busy stacks in the collapsed format: one 'outer;...;inner count' line per stack.
+        """
+        return ''.join(f'{stack} {count}\n' for stack, count in self._busy_stacks().most_common())
+
+    def report(self, limit=20):
+        """
+        The `limit` busiest stacks and the functions most often on top of a busy stack (self time).
+        """
+        stacks = self._busy_stacks()
+        total = sum(stacks.values())
+        leaf_functions = Counter()
+        for stack, count in stacks.items():
+            leaf_functions[stack.rsplit(';', 1)[-1]] += count
+
+        return {
+            'running': self.running,
+            'interval_ms': self.interval_ms,
+            'samples': self.samples,
+            'busy_thread_samples': total,
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at,
+            'top_functions': [{'function': function, 'samples': count, 'share': count / total} for function, count in leaf_functions.most_common(limit)],
+            'top_stacks': [{'stack': stack.split(';'), 'samples': count, 'share': count / total} for stack, count in stacks.most_common(limit)],
+        }
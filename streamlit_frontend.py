@@ -1,9 +1,72 @@
 # app.py
+import numpy as np
+import pandas as pd
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 
 # === Configure your FastAPI endpoint here ===
 API_URL = "http://127.0.0.1:8000/predict"   # <-- change to your actual endpoint
+BATCH_API_URL = API_URL + "/batch"
+
+# Fields the what-if panel can vary: label, lowest value, whether the field is an integer count
+WHAT_IF_FIELDS = {
+    "MonthlyIncome": ("Total Monthly Income ($)", 0.0, False),
+    "total_monthly_debt_payment": ("Total Monthly Debt Payment ($)", 0.0, False),
+    "total_unsecured_balance": ("Total Unsecured Balance ($)", 0.0, False),
+    "age": ("Age of the borrower", 18, True),
+    "NumberOfTimes90DaysLate": ("Times late by 90+ days", 0, True),
+    "NumberOfTime30_59DaysPastDueNotWorse": ("Times late by 30–59 days", 0, True),
+    "NumberOfTime60_89DaysPastDueNotWorse": ("Times late by 60–89 days", 0, True),
+    "NumberOfOpenCreditLinesAndLoans": ("Number of Open Credit Accounts", 0, True),
+    "NumberRealEstateLoansOrLines": ("Number of Mortgage or Real Estate Loans", 0, True),
+    "NumberOfDependents": ("Number of Dependents", 0, True),
+}
+
+
+@st.cache_resource
+def api_session():
+    """
+    One requests.Session per Streamlit server, so reruns reuse the keep-alive connections to the API.
+    """
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return session
+
+
+def what_if_values(field, current, upper, points):
+    """
+    The grid the what-if panel scores: `points` evenly spaced values of `field` between its lowest
+    value and `upper`, plus the current value. Counts are rounded and deduplicated.
+    """
+    _, lowest, is_count = WHAT_IF_FIELDS[field]
+    values = np.append(np.linspace(lowest, upper, points), current)
+    if is_count:
+        return sorted({int(round(value)) for value in values})
+    return sorted({round(float(value), 2) for value in values})
+
+
+@st.cache_data(ttl=300, show_spinner="Scoring the what-if grid...")
+def what_if_curve(payload, field, values):
+    """
+    Scores `payload` with `field` set to each of `values` in a single /predict/batch request (in the
+    columnar layout). Results are memoized on the inputs, so a rerun with the same panel settings
+    does not call the API again. Returns a frame of value -> Probability of Default and the number
+    of grid points the API rejected.
+    """
+    columns = {name: [value] * len(values) for name, value in payload.items()}
+    columns[field] = list(values)
+
+    resp = api_session().post(BATCH_API_URL, json={"columns": columns}, timeout=30)
+    resp.raise_for_status()
+    predictions = resp.json()["predictions"]
+
+    curve = pd.DataFrame(
+        [(values[p["index"]], p["Probability of Default "]) for p in predictions if "error" not in p],
+        columns=[field, "Probability of Default"]
+    )
+    return curve, len(values) - len(curve)
 
 st.set_page_config(page_title="Credit Risk Predictor", page_icon="💳", layout="centered")
 
@@ -147,34 +210,34 @@ with c2:
               "when MonthlyIncome = 0).")
     )
 
+# Enforce the constraint again before sending
+if total_unsecured_credit_limit == 0 and total_unsecured_balance != 0:
+    total_unsecured_balance = 0.0
+
+payload = {
+    "age": age,
+    "total_unsecured_balance": total_unsecured_balance,
+    "total_unsecured_credit_limit": total_unsecured_credit_limit,
+    "total_monthly_debt_payment": total_monthly_debt_payment,
+    "MonthlyIncome": MonthlyIncome,
+    "NumberOfOpenCreditLinesAndLoans": NumberOfOpenCreditLinesAndLoans,
+    "NumberOfTime30_59DaysPastDueNotWorse": NumberOfTime30_59DaysPastDueNotWorse,
+    "NumberOfTimes90DaysLate": NumberOfTimes90DaysLate,
+    "NumberRealEstateLoansOrLines": NumberRealEstateLoansOrLines,
+    "NumberOfTime60_89DaysPastDueNotWorse": NumberOfTime60_89DaysPastDueNotWorse,
+    "NumberOfDependents": NumberOfDependents
+}
+
 # --- Action ---
 st.markdown("---")
 send = st.button("🔮 Predict with Backend")
 
 if send:
-    # Enforce the constraint again before sending
-    if total_unsecured_credit_limit == 0 and total_unsecured_balance != 0:
-        total_unsecured_balance = 0.0
-
-    payload = {
-        "age": age,
-        "total_unsecured_balance": total_unsecured_balance,
-        "total_unsecured_credit_limit": total_unsecured_credit_limit,
-        "total_monthly_debt_payment": total_monthly_debt_payment,
-        "MonthlyIncome": MonthlyIncome,
-        "NumberOfOpenCreditLinesAndLoans": NumberOfOpenCreditLinesAndLoans,
-        "NumberOfTime30_59DaysPastDueNotWorse": NumberOfTime30_59DaysPastDueNotWorse,
-        "NumberOfTimes90DaysLate": NumberOfTimes90DaysLate,
-        "NumberRealEstateLoansOrLines": NumberRealEstateLoansOrLines,
-        "NumberOfTime60_89DaysPastDueNotWorse": NumberOfTime60_89DaysPastDueNotWorse,
-        "NumberOfDependents": NumberOfDependents
-    }
-
     with st.expander("🔍 Debug: payload being sent"):
         st.json(payload)
 
     try:
-        resp = requests.post(API_URL, json=payload, timeout=15)
+        resp = api_session().post(API_URL, json=payload, timeout=15)
         if resp.ok:
             result = resp.json()
             prob_default = result.get("Probability of Default ")
@@ -189,4 +252,47 @@ if send:
         else:
             st.error(f"❌ Error {resp.status_code}: {resp.text}")
     except Exception as e:
-        st.error(f"⚠️ Could not connect to API: {e}")
\ No newline at end of file
+        st.error(f"⚠️ Could not connect to API: {e}")
+
+# --- What-if ---
+st.markdown("---")
+st.subheader("📈 What-if analysis")
+st.caption("Vary one field and keep the others as entered above to see how the probability of default responds.")
+
+wcol1, wcol2 = st.columns(2)
+with wcol1:
+    what_if_field = st.selectbox(
+        "Field to vary",
+        options=list(WHAT_IF_FIELDS),
+        format_func=lambda name: WHAT_IF_FIELDS[name][0]
+    )
+with wcol2:
+    what_if_points = st.slider("Grid points", min_value=5, max_value=50, value=25, step=1)
+
+# upper end of the grid: the field's validation limit, or a multiple of the current value for amounts
+what_if_upper = {
+    "MonthlyIncome": max(20000.0, 3 * MonthlyIncome),
+    "total_monthly_debt_payment": max(5000.0, 3 * total_monthly_debt_payment),
+    "total_unsecured_balance": float(total_unsecured_credit_limit),
+    "age": 100,
+    "NumberOfTimes90DaysLate": 20,
+    "NumberOfTime30_59DaysPastDueNotWorse": 15,
+    "NumberOfTime60_89DaysPastDueNotWorse": 12,
+    "NumberOfOpenCreditLinesAndLoans": 60,
+    "NumberRealEstateLoansOrLines": 60,
+    "NumberOfDependents": 10,
+}[what_if_field]
+
+if st.toggle("Show the response curve"):
+    values = what_if_values(what_if_field, payload[what_if_field], what_if_upper, what_if_points)
+    try:
+        curve, rejected = what_if_curve(payload, what_if_field, values)
+        st.line_chart(curve, x=what_if_field, y="Probability of Default")
+        st.caption(
+            f"{len(values)} values scored in one batch request. "
+            f"The current value is {payload[what_if_field]}."
+        )
+        if rejected:
+            st.warning(f"⚠️ The API rejected {rejected} of the grid values.")
+    except Exception as e:
+        st.error(f"⚠️ Could not score the what-if grid: {e}")
@@ -0,0 +1,387 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# Only NumPy is needed to load and score a compiled model. The fitted sklearn / XGBoost / LightGBM
+# objects are only touched by compile_stacking_model() at export time.
+
+LINK_IDENTITY = 0
+LINK_LOGISTIC = 1
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _float32_split_threshold(threshold):
+    """
+    For float32 splits (float32(x) <= t) returns the float64 t' with x <= t' exactly when
+    float32(x) <= t, so scoring needs one comparison on the float64 input and no float32 copy.
+    """
+    threshold32 = threshold.astype(np.float32)
+    # the largest float32 that is <= t; float32(x) <= t holds exactly when float32(x) <= it
+    threshold32 = np.where(threshold32.astype(np.float64) > threshold, np.nextafter(threshold32, np.float32(-np.inf)), threshold32)
+    with np.errstate(over='ignore'):
+        above = np.nextafter(threshold32, np.float32(np.inf)).astype(np.float64)
+    lower = threshold32.astype(np.float64)
+    # float32 max: the next value up is inf, the rounding boundary is still half an ulp above
+    above = np.where(np.isinf(above) & np.isfinite(lower), lower + (lower - np.nextafter(threshold32, np.float32(-np.inf)).astype(np.float64)), above)
+    # x rounds to threshold32 or below when it is under the midpoint, or on it when the tie rounds
+    # to threshold32 (round half to even: its last mantissa bit is 0)
+    midpoint = (lower + above) / 2
+    ties_down = (threshold32.view(np.int32) & 1) == 0
+    return np.where(ties_down, midpoint, np.nextafter(midpoint, -np.inf))
+
+
+def _tree_depth(left, right, root=0):
+    depth, frontier = 0, [root]
+    while True:
+        children = [child for node in frontier for child in (left[node], right[node]) if child >= 0]
+        if not children:
+            return depth
+        depth += 1
+        frontier = children
+
+
+def _sklearn_forest_trees(forest):
+    """
+    Yields one node table per tree of a fitted sklearn RandomForestClassifier. Leaf values are the
+    fraction of the positive class, so the forest probability is the mean over trees. The cover of a
+    node is the weighted number of training samples that reached it.
+    """
+    for tree in forest.estimators_:
+        tree = tree.tree_
+        is_leaf = tree.children_left < 0
+        value = tree.value[:, 0, :]
+        value = value[:, 1] / value.sum(axis=1)
+        yield {
+            'feature': np.where(is_leaf, 0, tree.feature),
+            'threshold': np.where(is_leaf, 0.0, tree.threshold),
+            'left': tree.children_left,
+            'right': tree.children_right,
+            'default_left': getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=bool)).astype(bool),
+            'float32_split': np.ones(tree.node_count, dtype=bool),
+            'value': np.where(is_leaf, value, 0.0),
+            'cover': tree.weighted_n_node_samples,
+        }
+
+
+def _xgboost_trees(xgb_classifier):
+    """
+    Returns one node table per tree of a fitted binary:logistic XGBClassifier together with the
+    margin of its base score. The cover of a node is its sum of hessians, as in XGBoost's own
+    feature contributions.
+    """
+    learner = json.loads(xgb_classifier.get_booster().save_raw(raw_format='json'))['learner']
+    if learner['objective']['name'] != 'binary:logistic' or learner['gradient_booster']['name'] != 'gbtree':
+        raise ValueError("Only gbtree XGBClassifier models with the binary:logistic objective can be compiled")
+
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    trees = []
+    for tree in learner['gradient_booster']['model']['trees']:
+        left = np.asarray(tree['left_children'], dtype=np.int64)
+        right = np.asarray(tree['right_children'], dtype=np.int64)
+        split_conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        is_leaf = left < 0
+        # XGBoost sends x < t to the left on float32 inputs, which is x <= the float32 just below t
+        threshold = np.nextafter(split_conditions, np.float32(-np.inf)).astype(np.float64)
+        trees.append({
+            'feature': np.where(is_leaf, 0, tree['split_indices']),
+            'threshold': np.where(is_leaf, 0.0, threshold),
+            'left': left,
+            'right': right,
+            'default_left': np.asarray(tree['default_left'], dtype=bool),
+            'float32_split': np.ones(len(left), dtype=bool),
+            'value': np.where(is_leaf, split_conditions.astype(np.float64), 0.0),
+            'cover': np.asarray(tree['sum_hessian'], dtype=np.float64),
+        })
+    return trees, np.log(base_score / (1.0 - base_score))
+
+
+def _lightgbm_trees(lgbm_classifier):
+    """
+    Returns one node table per tree of a fitted binary LGBMClassifier together with its sigmoid scale.
+    The cover of a node is the number of training rows that reached it.
+    """
+    dump = lgbm_classifier.booster_.dump_model()
+    if not dump['objective'].startswith('binary') or dump['average_output']:
+        raise ValueError("Only boosted (not random forest mode) binary LGBMClassifier models can be compiled")
+    sigmoid_scale = float(dump['objective'].split('sigmoid:')[1].split()[0]) if 'sigmoid:' in dump['objective'] else 1.0
+
+    trees = []
+    for tree_info in dump['tree_info']:
+        nodes = {'feature': [], 'threshold': [], 'left': [], 'right': [], 'default_left': [], 'value': [], 'cover': []}
+        stack = [(tree_info['tree_structure'], None, None)]
+        while stack:
+            node, parent, side = stack.pop()
+            index = len(nodes['feature'])
+            if parent is not None:
+                nodes[side][parent] = index
+            nodes['left'].append(-1)
+            nodes['right'].append(-1)
+            if 'leaf_value' in node:
+                nodes['feature'].append(0)
+                nodes['threshold'].append(0.0)
+                nodes['default_left'].append(False)
+                nodes['value'].append(node['leaf_value'])
+                nodes['cover'].append(node['leaf_count'])
+                continue
+            if node['decision_type'] != '<=':
+                raise ValueError("Categorical LightGBM splits can not be compiled")
+            threshold = float(node['threshold'])
+            nodes['feature'].append(node['split_feature'])
+            nodes['threshold'].append(threshold)
+            # missing_type None: LightGBM scores NaN as 0.0, so it follows the branch 0.0 would take
+            nodes['default_left'].append(node['default_left'] if node['missing_type'] != 'None' else 0.0 <= threshold)
+            nodes['value'].append(0.0)
+            nodes['cover'].append(node['internal_count'])
+            stack.append((node['right_child'], index, 'right'))
+            stack.append((node['left_child'], index, 'left'))
+
+        table = {key: np.asarray(values) for key, values in nodes.items()}
+        table['float32_split'] = np.zeros(len(table['feature']), dtype=bool)
+        trees.append(table)
+    return trees, sigmoid_scale
+
+
+def _traversal_arrays(arrays):
+    """
+    Traversal tables derived from the node arrays: one float64 threshold per node (float32 splits
+    folded in), both children of node i at 2i (right) and 2i + 1 (left), and the leaf flags.
+    """
+    threshold = np.asarray(arrays['threshold'])
+    return {
+        'split_threshold': np.where(arrays['float32_split'], _float32_split_threshold(threshold), threshold),
+        'children': np.column_stack([arrays['right'], arrays['left']]).astype(np.intp).ravel(),
+        'is_leaf': np.asarray(arrays['left']) == np.arange(len(arrays['feature'])),
+    }
+
+
+def compile_stacking_model(stacking_model):
+    """
+    Flattens every tree of a fitted StackingClassifier (RandomForest / XGBoost / LightGBM base models
+    and a LogisticRegression meta-model) into contiguous node arrays.
+    """
+    if stacking_model.passthrough:
+        raise ValueError("Stacking models with passthrough=True can not be compiled")
+    if any(method != 'predict_proba' for method in stacking_model.stack_method_) or len(stacking_model.classes_) != 2:
+        raise ValueError("Only binary stacking models that stack predict_proba outputs can be compiled")
+
+    trees, tree_estimator, tree_weight = [], [], []
+    estimator_bias, estimator_scale, estimator_link = [], [], []
+
+    for estimator_index, (name, estimator) in enumerate(stacking_model.named_estimators_.items()):
+        kind = type(estimator).__name__
+        if kind == 'RandomForestClassifier':
+            estimator_trees, bias, scale, link = list(_sklearn_forest_trees(estimator)), 0.0, 1.0, LINK_IDENTITY
+        elif kind == 'XGBClassifier':
+            estimator_trees, bias = _xgboost_trees(estimator)
+            scale, link = 1.0, LINK_LOGISTIC
+        elif kind == 'LGBMClassifier':
+            estimator_trees, scale = _lightgbm_trees(estimator)
+            bias, link = 0.0, LINK_LOGISTIC
+        else:
+            raise ValueError(f"Base estimator '{name}' of type {kind} can not be compiled")
+
+        trees.extend(estimator_trees)
+        tree_estimator.extend([estimator_index] * len(estimator_trees))
+        tree_weight.extend([1.0 / len(estimator_trees) if link == LINK_IDENTITY else 1.0] * len(estimator_trees))
+        estimator_bias.append(bias)
+        estimator_scale.append(scale)
+        estimator_link.append(link)
+
+    offsets = np.cumsum([0] + [len(tree['feature']) for tree in trees])
+    concat = lambda key, dtype: np.concatenate([np.asarray(tree[key], dtype=dtype) for tree in trees])
+
+    left = np.concatenate([np.where(tree['left'] < 0, np.arange(len(tree['left'])), tree['left']) + offset for tree, offset in zip(trees, offsets)])
+    right = np.concatenate([np.where(tree['right'] < 0, np.arange(len(tree['right'])), tree['right']) + offset for tree, offset in zip(trees, offsets)])
+
+    final_estimator = stacking_model.final_estimator_
+    arrays = {
+        'feature': concat('feature', np.int32),
+        'threshold': concat('threshold', np.float64),
+        'left': left.astype(np.int32),
+        'right': right.astype(np.int32),
+        'default_left': concat('default_left', bool),
+        'float32_split': concat('float32_split', bool),
+        'value': concat('value', np.float64),
+        'cover': concat('cover', np.float64),
+        'tree_root': offsets[:-1].astype(np.int32),
+        'tree_estimator': np.asarray(tree_estimator, dtype=np.int32),
+        'tree_weight': np.asarray(tree_weight, dtype=np.float64),
+        'estimator_bias': np.asarray(estimator_bias, dtype=np.float64),
+        'estimator_scale': np.asarray(estimator_scale, dtype=np.float64),
+        'estimator_link': np.asarray(estimator_link, dtype=np.int8),
+        'estimator_names': np.asarray(list(stacking_model.named_estimators_), dtype=str),
+        'meta_coef': np.asarray(final_estimator.coef_, dtype=np.float64).ravel(),
+        'meta_intercept': np.asarray(final_estimator.intercept_, dtype=np.float64).ravel(),
+        'feature_names': np.asarray(stacking_model.feature_names_in_, dtype=str),
+        'max_depth': np.asarray(max(_tree_depth(tree['left'], tree['right']) for tree in trees), dtype=np.int32),
+    }
+    # saved with the rest, so a memory-mapped model shares them between workers too
+    arrays.update(_traversal_arrays(arrays))
+    return CompiledStackingModel(arrays)
+
+
+def _publish_directory(path, version_dir):
+    """
+    Points `path` at version_dir by swapping a symlink with one rename, so a process loading `path`
+    sees either the previous files or the new ones, never a mix. The previous version is deleted
+    afterwards: workers that memory-mapped its files keep reading them until they unmap them, as
+    deleted files are only freed then (overwriting them in place would truncate them under the
+    workers instead).
+    """
+    parent, name = os.path.dirname(os.path.abspath(path)), os.path.basename(os.path.abspath(path))
+    previous = None
+    if os.path.islink(path):
+        previous = os.path.join(parent, os.readlink(path))
+    elif os.path.isdir(path):
+        # a plain directory from an older save is moved aside; `path` is missing for that instant
+        previous = version_dir + '.previous'
+        os.rename(path, previous)
+
+    link = version_dir + '.link'
+    os.symlink(os.path.basename(version_dir), link)
+    os.replace(link, path)
+
+    # only versions written here are deleted, never a directory the link was pointed at by hand
+    if (previous and os.path.isdir(previous) and os.path.dirname(os.path.abspath(previous)) == parent
+            and os.path.basename(previous).startswith(name + '.') and os.path.abspath(previous) != os.path.abspath(version_dir)):
+        shutil.rmtree(previous)
+
+
+class CompiledStackingModel:
+    """
+    Scores a compiled stacking model with one vectorized traversal over all base-model trees,
+    using NumPy only.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        for key, value in arrays.items():
+            setattr(self, key, value)
+        self.classes_ = np.array([0.0, 1.0])
+        self.feature_names_in_ = self.feature_names
+        # trees of one base estimator are stored next to each other
+        self.estimator_offsets = np.searchsorted(self.tree_estimator, np.arange(len(self.estimator_bias)))
+
+        # exports written before the traversal tables were saved get them rebuilt in private memory
+        traversal = arrays if 'split_threshold' in arrays else _traversal_arrays(arrays)
+        self._split_threshold = traversal['split_threshold']
+        self._children = traversal['children']
+        self._is_leaf = traversal['is_leaf']
+
+    def save(self, path):
+        """
+        Saves to a single .npz file, or, for any other path, to a directory with one .npy file per
+        array. The directory layout can be memory-mapped by load().
+
+        Both are replaced atomically, so a model can be saved over the one an API is serving. A
+        directory is written as a new version `<path>.<random>` next to it, and `path` becomes a
+        symlink to the latest version.
+        """
+        if path.endswith('.npz'):
+            temporary = f"{path[:-4]}.{os.getpid()}.tmp.npz"
+            np.savez(temporary, **self.arrays)
+            os.replace(temporary, path)
+            return
+        version_dir = tempfile.mkdtemp(prefix=os.path.basename(os.path.abspath(path)) + '.', dir=os.path.dirname(os.path.abspath(path)))
+        # mkdtemp creates it private to this user; workers may run as another one
+        os.chmod(version_dir, 0o755)
+        for key, value in self.arrays.items():
+            np.save(os.path.join(version_dir, f"{key}.npy"), value, allow_pickle=False)
+        _publish_directory(path, version_dir)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a model saved by save(). Arrays of the directory layout are memory-mapped read-only
+        when mmap=True, so processes that load the same files share one copy in the page cache.
+        """
+        if os.path.isdir(path):
+            mmap_mode = 'r' if mmap else None
+            return cls({file_name[:-4]: np.load(os.path.join(path, file_name), mmap_mode=mmap_mode, allow_pickle=False)
+                        for file_name in sorted(os.listdir(path)) if file_name.endswith('.npy')})
+        with np.load(path, allow_pickle=False) as data:
+            return cls({key: data[key] for key in data.files})
+
+    def touch(self):
+        """
+        Reads one byte per memory page of every array so that a memory-mapped model is resident
+        before it serves traffic.
+        """
+        for value in self.arrays.values():
+            if value.nbytes:
+                np.ascontiguousarray(value).reshape(-1).view(np.uint8)[::4096].max()
+
+    def _as_matrix(self, X):
+        if hasattr(X, 'columns'):
+            X = X[list(self.feature_names)].to_numpy(dtype=np.float64)
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != len(self.feature_names):
+            raise ValueError(f"X has {X.shape[1]} features, but the model expects {len(self.feature_names)}")
+        return X
+
+    def _leaf_indices_block(self, X):
+        n_samples, n_features = X.shape
+        n_trees = len(self.tree_root)
+        X_flat = X.ravel()
+        has_nan = np.isnan(X_flat).any()
+
+        nodes = np.tile(self.tree_root.astype(np.intp), n_samples)
+        row_start = np.repeat(np.arange(n_samples) * n_features, n_trees)
+        # only (row, tree) pairs that have not reached a leaf yet are advanced, so shallow trees
+        # stop costing anything once they are done
+        active = np.flatnonzero(~self._is_leaf[nodes])
+        while active.size:
+            node = nodes[active]
+            x = X_flat[row_start[active] + self.feature[node]]
+            go_left = x <= self._split_threshold[node]
+            if has_nan:
+                go_left = np.where(np.isnan(x), self.default_left[node], go_left)
+            node = self._children[2 * node + go_left]
+            nodes[active] = node
+            active = active[~self._is_leaf[node]]
+        return nodes.reshape(n_samples, n_trees)
+
+    def _blocks(self, X, block_size=1024):
+        # a block of rows keeps the (rows x trees) work arrays small enough for the CPU caches
+        X = np.ascontiguousarray(self._as_matrix(X))
+        for start in range(0, len(X), block_size):
+            yield start, X[start:start + block_size]
+
+    def leaf_indices(self, X):
+        """
+        Returns the leaf node reached by every row of X in every tree, shape (n_samples, n_trees).
+        """
+        return np.concatenate([self._leaf_indices_block(block) for _, block in self._blocks(X)] or [np.empty((0, len(self.tree_root)), dtype=np.intp)])
+
+    def base_predict_proba(self, X):
+        """
+        Returns the positive-class probability of each base estimator, shape (n_samples, n_estimators).
+        """
+        X = self._as_matrix(X)
+        raw = np.empty((len(X), len(self.estimator_bias)))
+        for start, block in self._blocks(X):
+            leaf_values = self.value[self._leaf_indices_block(block)] * self.tree_weight
+            raw[start:start + len(block)] = np.add.reduceat(leaf_values, self.estimator_offsets, axis=1)
+        raw += self.estimator_bias
+        return np.where(self.estimator_link == LINK_LOGISTIC, _sigmoid(raw * self.estimator_scale), raw)
+
+    def meta_predict_proba(self, base_probabilities):
+        """
+        Applies the LogisticRegression meta-model to the output of base_predict_proba.
+        """
+        probability = _sigmoid(base_probabilities @ self.meta_coef + self.meta_intercept[0])
+        return np.column_stack([1.0 - probability, probability])
+
+    def predict_proba(self, X):
+        return self.meta_predict_proba(self.base_predict_proba(X))
+
+    def predict(self, X):
+        return self.classes_[(self.predict_proba(X)[:, 1] > 0.5).astype(int)]
@@ -0,0 +1,208 @@
+import numpy as np
+
+from tree_compiler import LINK_LOGISTIC, _sigmoid
+
+# Path-dependent TreeSHAP (Lundberg et al., "Consistent Individualized Feature Attribution for Tree
+# Ensembles") computed one root-to-leaf path at a time, for many rows and paths at once. For a path
+# with leaf value v whose splits use the distinct features 1..d, let z_k be the share of the
+# training cover that follows the path's splits on feature k and o_k be 1 when the row follows all
+# of them, 0 otherwise. The path adds to feature i
+#
+#     v * (o_i - z_i) * integral over u from 0 to 1 of prod_{k != i} (z_k + (o_k - z_k) * u)
+#
+# (the Shapley weights written as a Beta integral). The integrand is a polynomial of degree d - 1,
+# so a Gauss-Legendre rule with ceil(d / 2) nodes integrates it exactly.
+#
+# A path's values depend on the row only through its d-bit pattern o. For paths with few distinct
+# features the values of all 2^d patterns are computed up front, so explaining a row is a lookup.
+
+# upper bound for the (rows x paths x features x nodes) work arrays of one block
+_BLOCK_ELEMENTS = 2 ** 21
+# rows whose split decisions are computed together
+_ROW_BLOCK = 32
+
+
+class TreeShapExplainer:
+    """
+    Feature attributions for a CompiledStackingModel. The paths of every tree are decomposed once,
+    when the explainer is created, and the values of the paths with the fewest distinct features
+    are tabulated for every pattern, up to max_table_bytes. Explaining a batch then takes a few
+    vectorized NumPy passes.
+
+    shap_values() returns TreeSHAP values of every base estimator in its own output space
+    (probability for the RandomForest, margin for XGBoost and LightGBM) and stacks them through the
+    meta-model: the attributions of an estimator are scaled by its meta-model coefficient and by the
+    slope of its link function between the expected and the actual output. The stacked attributions
+    are in log-odds of default and add up to logit(probability) minus base_value.
+    """
+
+    def __init__(self, model, max_table_bytes=256 * 2**20):
+        if 'cover' not in model.arrays:
+            raise ValueError("The compiled model has no node covers; compile it again with this version to explain predictions")
+        self.model = model
+        self.feature_names = [str(name) for name in model.feature_names]
+
+        n_features = len(self.feature_names)
+        n_estimators = len(model.estimator_bias)
+        left, right, feature = np.asarray(model.left), np.asarray(model.right), np.asarray(model.feature)
+        cover, value = np.asarray(model.cover, dtype=np.float64), np.asarray(model.value, dtype=np.float64)
+        threshold, default_left, is_leaf = model._split_threshold, np.asarray(model.default_left), model._is_leaf
+
+        expected = np.zeros(n_estimators)
+        paths = {}
+        for tree, root in enumerate(np.asarray(model.tree_root)):
+            estimator = int(model.tree_estimator[tree])
+            weight = float(model.tree_weight[tree])
+            stack = [(int(root), ())]
+            while stack:
+                node, edges = stack.pop()
+                if not is_leaf[node]:
+                    stack.append((int(left[node]), edges + ((node, True),)))
+                    stack.append((int(right[node]), edges + ((node, False),)))
+                    continue
+                expected[estimator] += weight * value[node] * cover[node] / cover[root]
+                if not edges:
+                    continue
+
+                # a row follows all the path's splits on a feature when its value is in (lower, upper],
+                # or, for NaN, when every one of those splits sends NaN the path's way
+                slots = {}
+                for parent, went_left in edges:
+                    slot = slots.setdefault(int(feature[parent]), [1.0, -np.inf, np.inf, True])
+                    slot[0] *= cover[left[parent] if went_left else right[parent]] / cover[parent]
+                    if went_left:
+                        slot[2] = min(slot[2], threshold[parent])
+                    else:
+                        slot[1] = max(slot[1], threshold[parent])
+                    slot[3] = slot[3] and default_left[parent] == went_left
+                paths.setdefault(len(slots), []).append((weight * value[node], estimator, list(slots), list(slots.values())))
+
+        # paths are grouped by their number of distinct features d, so every group is a dense array
+        self._groups = []
+        self.table_bytes = 0
+        for d, group in sorted(paths.items()):
+            nodes, weights = np.polynomial.legendre.leggauss((d + 1) // 2)
+            slots = np.array([path[3] for path in group], dtype=np.float64)
+            features = np.array([path[2] for path in group], dtype=np.intp)
+            self._groups.append({
+                'd': d,
+                'value': np.array([path[0] for path in group]),
+                'feature': features,
+                'column': np.array([path[1] for path in group])[:, None] * n_features + features,
+                'z': slots[..., 0],
+                'lower': slots[..., 1],
+                'upper': slots[..., 2],
+                'nan_follows': slots[..., 3] == 1,
+                'u': (nodes + 1) / 2,
+                'u_weight': weights / 2,
+            })
+
+            group = self._groups[-1]
+            table_bytes = len(group['value']) * 2**d * d * 8
+            if self.table_bytes + table_bytes <= max_table_bytes:
+                group['table'] = self._pattern_table(group)
+                self.table_bytes += table_bytes
+
+        self.n_paths = sum(len(group['value']) for group in self._groups)
+        # expected output of every base estimator over the training cover, and of the meta-model
+        self.expected_raw = expected + model.estimator_bias
+        self.base_value = float(self._link(self.expected_raw) @ model.meta_coef + model.meta_intercept[0])
+
+    def _link(self, raw):
+        return np.where(self.model.estimator_link == LINK_LOGISTIC, _sigmoid(raw * self.model.estimator_scale), raw)
+
+    def _follows(self, group, X):
+        # o: whether each row follows all of a path's splits on each of its features, (rows, paths, d)
+        x = X[:, group['feature']]
+        o = (x > group['lower']) & (x <= group['upper'])
+        if np.isnan(x).any():
+            o = np.where(np.isnan(x), group['nan_follows'], o)
+        return o
+
+    def _path_values(self, group, o):
+        """
+        The values each path adds to each of its features for the patterns o, shape (rows, paths, d).
+        """
+        z, u = group['z'], group['u']
+        # with the features split into followed (o = 1) and not followed (o = 0) ones, the integrand
+        # is K (1 - u)^n0 H(u) / g_i(u) for a followed feature i and K (1 - u)^(n0 - 1) H(u) for the
+        # others, where g_k = z_k + (1 - z_k) u, H is the product of g over the followed features, K
+        # the product of z over the others and n0 their number
+        g = np.where(o[..., None], z[..., None] + (1 - z)[..., None] * u, 1.0)
+        H = g.prod(axis=2)
+        K = np.where(o, 1.0, z).prod(axis=2)
+        n0 = z.shape[1] - o.sum(axis=2)
+        followed = (H * (1 - u) ** n0[..., None])[:, :, None, :] / g @ group['u_weight']
+        # only used where n0 >= 1
+        not_followed = (H * (1 - u) ** np.maximum(n0 - 1, 0)[..., None]) @ group['u_weight']
+        values = np.where(o, (1 - z) * followed, -not_followed[..., None])
+        return (group['value'] * K)[..., None] * values
+
+    def _pattern_table(self, group):
+        # path values for all 2^d patterns, shape (paths, 2^d, d); bit k of a pattern is o_k
+        d = group['d']
+        patterns = (np.arange(2**d)[:, None] >> np.arange(d)) & 1 == 1
+        table = np.empty((len(group['value']), 2**d, d))
+        block_size = max(1, _BLOCK_ELEMENTS // (group['z'].size * len(group['u'])))
+        for start in range(0, 2**d, block_size):
+            block = patterns[start:start + block_size]
+            o = np.broadcast_to(block[:, None, :], (len(block), *group['z'].shape))
+            table[:, start:start + len(block)] = self._path_values(group, o).transpose(1, 0, 2)
+        return table.reshape(-1, d)
+
+    def _group_shap_values(self, group, X):
+        o = self._follows(group, X)
+        if 'table' in group:
+            pattern = (o << np.arange(group['d'])).sum(axis=2)
+            return group['table'][np.arange(o.shape[1]) * 2**group['d'] + pattern]
+        block_size = max(1, _BLOCK_ELEMENTS // (group['z'].size * len(group['u'])))
+        return np.concatenate([self._path_values(group, o[start:start + block_size]) for start in range(0, len(o), block_size)])
+
+    def base_shap_values(self, X):
+        """
+        TreeSHAP values of every base estimator in its output space, shape (n_samples,
+        n_estimators, n_features). Along the features they add up to each estimator's output minus
+        expected_raw.
+        """
+        X = self.model._as_matrix(X)
+        n_columns = len(self.model.estimator_bias) * len(self.feature_names)
+        values = np.zeros((len(X), n_columns))
+
+        for start in range(0, len(X), _ROW_BLOCK):
+            block = X[start:start + _ROW_BLOCK]
+            row_offset = np.arange(len(block))[:, None] * n_columns
+            for group in self._groups:
+                path_values = self._group_shap_values(group, block)
+                columns = row_offset + group['column'].ravel()
+                values[start:start + len(block)] += np.bincount(columns.ravel(), weights=path_values.ravel(), minlength=len(block) * n_columns).reshape(len(block), n_columns)
+
+        return values.reshape(len(X), len(self.model.estimator_bias), len(self.feature_names))
+
+    def shap_values(self, X):
+        """
+        Attributions of the stacked model in log-odds of default, shape (n_samples, n_features).
+        Each row adds up to logit(predict_proba) - base_value.
+        """
+        base_values = self.base_shap_values(X)
+        raw = self.expected_raw + base_values.sum(axis=2)
+        change = raw - self.expected_raw
+
+        # slope of the link between the expected and the actual output (its derivative when they meet)
+        scale = self.model.estimator_scale
+        expected_probability = _sigmoid(self.expected_raw * scale)
+        derivative = np.where(self.model.estimator_link == LINK_LOGISTIC, scale * expected_probability * (1 - expected_probability), 1.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            secant = (self._link(raw) - self._link(self.expected_raw)) / change
+        slope = np.where(np.abs(change) > 1e-12, secant, derivative)
+
+        return np.einsum('nef,ne->nf', base_values, slope * self.model.meta_coef)
+
+    def reason_codes(self, X, top_k=3):
+        """
+        For every row, up to top_k (feature, contribution) pairs of the features that raised the
+        predicted risk the most, largest first. Contributions are in log-odds of default.
+        """
+        values = self.shap_values(X)
+        order = np.argsort(-values, axis=1)[:, :top_k]
+        return [[(self.feature_names[feature], float(row[feature])) for feature in features if row[feature] > 0]
+                for row, features in zip(values, order)]